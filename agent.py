@@ -1,14 +1,16 @@
-from fastapi import FastAPI, Request,UploadFile, File, UploadFile, BackgroundTasks, HTTPException, Body
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, WebSocket, Request,UploadFile, File, Form, UploadFile, BackgroundTasks, HTTPException, Body
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 import whisper
+import logging
 import re
 import os
 import time
 import asyncio
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import SystemMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_ollama import OllamaLLM
@@ -18,37 +20,134 @@ import numpy as np
 import io, asyncio
 from fastapi.responses import StreamingResponse
 from scipy.io import wavfile
-import pyttsx3
 import soundfile as sf
 import ffmpeg
-# App initialization
-app = FastAPI()
+from audio_delivery import audio_encoder, audio_url, serve_audio
+from audio_io import decode_audio_bytes
+from health import Readiness, warm
+from history_compaction import CompactedHistory, HistoryCompactor
+from model_registry import PRELOAD_MODELS, VOICE_ENABLED, ModelRegistry
+from observability import configure_logging, instrument, span
+from llm_scheduler import LLMQueueFull, ScheduledLLM, llm_config, llm_scheduler
+from ollama_backend import OLLAMA_MODEL, ollama_backend
+from session_store import SessionStore, resolve_session_id
+from streaming import SUGGESTIONS_MARKER, SuggestionStream, ndjson
+from transcription import TranscriptionBatcher, stream_transcription
+from tts import SpeechPipeline, TTSQueueFull, audio_cache, tts_pool
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(audio_cache.evict)
+    # Spawn the TTS workers and load and warm every eager model in parallel, before the first request
+    await asyncio.gather(
+        warm(readiness, "tts", tts_pool.start),
+        *(warm(readiness, name, partial(registry.warm_up, name)) for name in registry.eager()),
+    )
+    # Ollama may still be starting up; keep trying in the background rather than blocking startup
+    ollama_warm_up = asyncio.create_task(warm(
+        readiness, "ollama", lambda: ollama_backend.warm_up(warm_up_llm), ollama_backend.model_loaded, retry_every=10
+    ))
+    yield
+    ollama_warm_up.cancel()
+    tts_pool.shutdown()
 
-# Directories for uploads and generated audio
-UPLOAD_AUDIO_DIR = Path("uploads/audio")
+
+# App initialization
+configure_logging()
+logger = logging.getLogger(__name__)
+app = FastAPI(lifespan=lifespan)
+# Trace ids, per-route request metrics and GET /metrics
+instrument(app)
+# Compressed speech at GET /audio/{name}
+serve_audio(app)
+
+# Directory for generated audio
 RESPONSE_AUDIO_DIR = Path("static/audio")
-for directory in (UPLOAD_AUDIO_DIR, RESPONSE_AUDIO_DIR):
-    directory.mkdir(parents=True, exist_ok=True)
+RESPONSE_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Load Whisper model once
-whisper_model = whisper.load_model("base")
 
-# Initialize TTS engine once
-tts_engine = pyttsx3.init()
-voices = tts_engine.getProperty("voices")
-for v in voices:
-    if "male" in v.name.lower() or "male" in v.id:
-        tts_engine.setProperty("voice", v.id)
-        break
+def warm_up_llm():
+    # A one-token answer through the real prompt, so Ollama caches the system prompt prefix
+    (chat_prompt | base_llm.bind(options={"num_predict": 1})).invoke({"query": "Hello", "history": []})
+
+
+@app.exception_handler(TTSQueueFull)
+async def tts_queue_full_handler(request, exc: TTSQueueFull):
+    return JSONResponse(status_code=503, content={"error": str(exc)})
+
+
+@app.exception_handler(LLMQueueFull)
+async def llm_queue_full_handler(request, exc: LLMQueueFull):
+    return JSONResponse(status_code=exc.status_code, content={"error": str(exc)})
+
+
+@app.get("/health")
+async def health():
+    """Readiness: 200 once every model is loaded and warm, 503 until then."""
+    ready, components = await asyncio.to_thread(readiness.status)
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": components})
+
+
+@app.get("/models")
+async def models():
+    """Load and warm-up time of each heavy component; lazy ones show as not loaded until first use."""
+    return JSONResponse(registry.stats())
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """In-flight and queued generations, rejections, and queue wait vs. generation time per priority."""
+    return JSONResponse(llm_scheduler.stats())
+
+
+@app.get("/tts/stats")
+async def tts_stats():
+    """Queue depth and synthesis timings of the TTS worker pool, audio cache hit rate and encoding."""
+    return JSONResponse({**tts_pool.stats(), "cache": audio_cache.stats(), "encoding": audio_encoder.stats()})
+
+
+@app.get("/whisper/stats")
+async def whisper_stats():
+    """Micro-batching counters of the transcription scheduler."""
+    if not registry.loaded("whisper"):
+        return JSONResponse({"loaded": False})
+    return JSONResponse(registry.get("whisper").stats())
+
 
 # Device selection for LLM
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+
+# Heavy models are loaded by the registry in the lifespan, not at import time
+registry = ModelRegistry()
+
+
+def load_whisper() -> TranscriptionBatcher:
+    # Concurrent uploads are transcribed together in micro-batches
+    return TranscriptionBatcher(whisper.load_model(WHISPER_MODEL), fp16=device == "cuda")
+
+
+# Whisper is only loaded on first use when voice input is disabled
+registry.register("whisper", load_whisper, TranscriptionBatcher.warm_up, lazy=not VOICE_ENABLED, fork_safe=True)
+readiness = Readiness(registry.eager() + ["ollama", "tts"])
+
+if PRELOAD_MODELS and device == "cpu":
+    # Under `gunicorn --preload`, forked workers share these weights instead of loading their own
+    registry.preload()
+
 # Initialize LLM and parser
-llm = OllamaLLM(model="llama3.2:3B", device=device)
+# Pinned in memory through keep_alive and sharing the backend's pooled HTTP client
+base_llm = ollama_backend.attach(OllamaLLM(
+    model=OLLAMA_MODEL,
+    base_url=ollama_backend.base_url,
+    keep_alive=ollama_backend.keep_alive,
+    device=device
+))
+# Every generation goes through the shared scheduler, which bounds concurrent requests to Ollama
+llm = ScheduledLLM(base_llm, llm_scheduler)
 parser = StrOutputParser()
 
 
@@ -120,13 +219,14 @@ chat_prompt = ChatPromptTemplate.from_messages([
     HumanMessagePromptTemplate.from_template("{query}")
 ])
 
-# Build chain and wrap with in-memory history
+# Build chain and wrap with per-session history (SQLite-backed, bounded in memory)
 chain = chat_prompt | llm | parser
-store: dict[str, ChatMessageHistory] = {}
-def get_history(session_id: str) -> ChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+session_store = SessionStore()
+compactor = HistoryCompactor(llm)
+
+def get_history(session_id: str) -> CompactedHistory:
+    # Prompt sees recent turns verbatim plus a running summary of older ones
+    return CompactedHistory(session_store.get(session_id), compactor, session_id)
 
 conversation = RunnableWithMessageHistory(
     runnable=chain,
@@ -164,86 +264,204 @@ def parse_response_and_suggestions(raw: str) -> tuple[str, list[str]]:
     
 @app.post("/whisper")
 async def whisper_endpoint(file: UploadFile = File(...)):
-    path = UPLOAD_AUDIO_DIR / file.filename
+    data = await file.read()
+    with span("decode"):
+        try:
+            # Decoded straight from the request bytes; nothing touches the disk
+            audio = await asyncio.to_thread(decode_audio_bytes, data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        with open(path, "wb") as f:
-            f.write(await file.read())
-        result = await asyncio.to_thread(whisper_model.transcribe, str(path))
-        text = result.get("text", "")
-        print(text)
-        os.remove(path)
+        transcriber = await registry.aget("whisper")
+        with span("stt"):
+            text = await transcriber.transcribe(audio)
+        logger.debug("Transcription: %s", text)
         return JSONResponse({"transcription": text})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.websocket("/whisper/stream")
+async def whisper_stream_endpoint(websocket: WebSocket):
+    """Incremental transcription: speech segments are transcribed while the user is still talking."""
+    await stream_transcription(websocket, await registry.aget("whisper"))
+
+
+def clean_response(raw: str) -> str:
+    """Strip markdown and section headings the LLM adds around the answer."""
+    return raw.replace("\n", "").replace("*", " ").replace("Mentorship Response", "").replace("Engagement Question", "").replace(": ", "").replace("   ", "")
+
+
+def new_speech_pipeline() -> SpeechPipeline:
+    """Sentence-level TTS for one answer; audio is cached by text in static/audio."""
+    return SpeechPipeline(clean_response, SUGGESTIONS_MARKER)
+
+
+def answer_with_audio(q: str, session_id: str, timings: dict) -> tuple[str, list[str], Path | None]:
+    """
+    Stream the LLM answer into the TTS pipeline so speech is synthesized during generation.
+    Seconds spent generating and then waiting for the remaining audio go into `timings`.
+    """
+    speech = new_speech_pipeline()
+    raw = ""
+    with span("llm", timings):
+        for token in conversation.stream(
+            {"query": q},
+            {**llm_config(session_id), "configurable": {"session_id": session_id}}
+        ):
+            raw += token
+            speech.feed(token)
+    logger.debug("Generated response: %s", raw)
+
+    with span("parse"):
+        main_resp, suggestions = parse_response_and_suggestions(clean_response(raw))
+    with span("tts", timings):
+        audio_path = speech.finish()
+    return main_resp, suggestions, audio_path
+
+
+def rounded(timings: dict, started: float) -> dict:
+    return {
+        **{stage: round(seconds, 3) for stage, seconds in timings.items()},
+        "total": round(time.perf_counter() - started, 3),
+    }
+
+
 @app.post("/ask")
 async def ask(payload: dict = Body(...), background_tasks: BackgroundTasks = None):
     q = payload.get("query")
     if not q:
         raise HTTPException(status_code=400, detail="Query missing")
-    session_id = "default_session"
+    session_id = resolve_session_id(payload.get("session_id"))
 
-    # Generate LLM response with history
-    result = await asyncio.to_thread(
-        conversation.invoke,
-        {"query": q},
-        {"session_id": session_id}
-    )
-    
-    print(f"Query: {q}")
-    response_text = result.get("output") if isinstance(result, dict) else str(result)
-    response_text = response_text.replace("\n", "").replace("*", " ").replace("Mentorship Response", "").replace("Engagement Question", "").replace(": ", "").replace("   ", "")  
-    print(f"Generated response: {response_text}")
+    # Generate LLM response with history; TTS runs sentence by sentence alongside it
+    logger.info("Question for session %s (%d chars)", session_id, len(q))
+    started, timings = time.perf_counter(), {}
+    main_resp, suggestions, audio_path = await asyncio.to_thread(answer_with_audio, q, session_id, timings)
 
-    main_resp, suggestions = parse_response_and_suggestions(response_text)
-    print(f"Parsed response: {main_resp}")
-    print(f"Parsed suggestions: {suggestions}")
+    return JSONResponse({
+        "response": main_resp,
+        "suggestions": suggestions,
+        "audio_url": audio_url(audio_path),
+        "session_id": session_id,
+        "timings": rounded(timings, started)
+    })
 
 
-    # Queue TTS generation
-    ts = int(time.time() * 1000)
-    filename = f"response_{ts}.mp3"
-    out_path = RESPONSE_AUDIO_DIR / filename
-    await asyncio.to_thread(generate_audio_from_response, main_resp, out_path) 
+@app.post("/ask/stream")
+async def ask_stream(payload: dict = Body(...)):
+    """
+    Streaming variant of /ask. Emits newline-delimited JSON events:
+      {"type": "token", "text": ...}           as Ollama produces tokens
+      {"type": "suggestion", "text": ...}      as each follow-up prompt completes
+      {"type": "audio", "url": ...}            as each spoken sentence is synthesized
+      {"type": "done", "response": ..., "suggestions": [...], "audio_url": ..., "timings": {...}}
+    """
+    q = payload.get("query")
+    if not q:
+        raise HTTPException(status_code=400, detail="Query missing")
+    session_id = resolve_session_id(payload.get("session_id"))
+
+    # Sync generator: Starlette iterates it in the threadpool, off the event loop
+    events = answer_events(q, session_id, {}, time.perf_counter())
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
+
+
+def answer_events(q: str, session_id: str, timings: dict, started: float):
+    """Sync generator of the /ask/stream events; `timings` may already hold earlier stages."""
+    stream = SuggestionStream(parse_response_and_suggestions, clean_response)
+    speech = new_speech_pipeline()
+    start = time.perf_counter()
+    try:
+        for token in conversation.stream(
+            {"query": q},
+            {**llm_config(session_id), "configurable": {"session_id": session_id}}
+        ):
+            yield {"type": "token", "text": token}
+            for suggestion in stream.feed(token):
+                yield {"type": "suggestion", "text": suggestion}
+            speech.feed(token)
+            for segment in speech.ready_segments():
+                yield {"type": "audio", "url": audio_url(segment)}
+    except LLMQueueFull as e:
+        # Headers are already sent, so the rejection is reported in-band
+        yield {"type": "error", "status": e.status_code, "error": str(e)}
+        return
+    timings["llm"] = time.perf_counter() - start
+
+    main_resp, suggestions, remaining = stream.close()
+    for suggestion in remaining:
+        yield {"type": "suggestion", "text": suggestion}
 
+    try:
+        with span("tts", timings):
+            audio_path = speech.finish()
+    except Exception as e:
+        # The answer is complete, so the missing speech is reported in-band and "done" still follows
+        logger.warning("Speech synthesis failed: %s", e)
+        status = 503 if isinstance(e, TTSQueueFull) else 500
+        yield {"type": "error", "status": status, "error": f"Speech synthesis failed: {e}"}
+        audio_path = None
+    for segment in speech.ready_segments():
+        yield {"type": "audio", "url": audio_url(segment)}
+    yield {
+        "type": "done",
+        "response": main_resp,
+        "suggestions": suggestions,
+        "audio_url": audio_url(audio_path),
+        "session_id": session_id,
+        "timings": rounded(timings, started)
+    }
+
+
+async def transcribe_upload(file: UploadFile, timings: dict) -> str:
+    """Decode and transcribe an uploaded recording in memory, recording both stages in `timings`."""
+    data = await file.read()
+    with span("decode", timings):
+        try:
+            audio = await asyncio.to_thread(decode_audio_bytes, data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    with span("stt", timings):
+        transcriber = await registry.aget("whisper")
+        text = (await transcriber.transcribe(audio)).strip()
+    logger.debug("Transcription: %s", text)
+    if not text:
+        raise HTTPException(status_code=400, detail="No speech detected")
+    return text
+
+
+@app.post("/voice-ask")
+async def voice_ask(file: UploadFile = File(...), session_id: str | None = Form(None)):
+    """
+    Voice in, voice out in one request: the recording is transcribed in memory and answered
+    straight away. Returns the /ask fields plus the transcription and per-stage timings in seconds
+    (this server has no retrieval stage).
+    """
+    started, timings = time.perf_counter(), {}
+    text = await transcribe_upload(file, timings)
+    session_id = resolve_session_id(session_id)
+    main_resp, suggestions, audio_path = await asyncio.to_thread(answer_with_audio, text, session_id, timings)
     return JSONResponse({
+        "transcription": text,
         "response": main_resp,
         "suggestions": suggestions,
-        "audio_url": f"http://10.7.0.28:5505/static/audio/{filename}"
+        "audio_url": audio_url(audio_path),
+        "session_id": session_id,
+        "timings": rounded(timings, started)
     })
 
-# # Synchronous TTS worker
-# def generate_audio_from_response(response_text: str, out_path: Path) -> None:
-#     tts_engine.save_to_file(response_text, str(out_path))
-#     tts_engine.runAndWait()
-
-#     # extra safety: make sure data is on disk
-#     with open(out_path, "rb+") as f:
-#         f.flush()
-#         os.fsync(f.fileno())
-   
-import pyttsx3, os, stat
-
-def generate_audio_from_response(response_text: str, out_path: Path) -> None:
-    # 1. New engine for each file
-    engine = pyttsx3.init()
-    # (Re-apply your male-voice selection if needed)
-    for v in engine.getProperty("voices"):
-        if "male" in v.name.lower() or "male" in v.id:
-            engine.setProperty("voice", v.id)
-            break
-
-    engine.save_to_file(response_text, str(out_path))
-    engine.runAndWait()
-    engine.stop()
-
-    # 2. Flush to disk
-    with open(out_path, "rb+") as f:
-        f.flush()
-        os.fsync(f.fileno())  
-
-    # 3. (Optional) loosen perms if on Unix
-    try:
-        out_path.chmod(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
-    except Exception:
-        pass
+
+@app.post("/voice-ask/stream")
+async def voice_ask_stream(file: UploadFile = File(...), session_id: str | None = Form(None)):
+    """Streaming variant of /voice-ask: a {"type": "transcription"} event, then the /ask/stream events."""
+    started, timings = time.perf_counter(), {}
+    text = await transcribe_upload(file, timings)
+    session_id = resolve_session_id(session_id)
+
+    def events():
+        yield {"type": "transcription", "text": text}
+        yield from answer_events(text, session_id, timings, started)
+
+    return StreamingResponse(ndjson(events()), media_type="application/x-ndjson")
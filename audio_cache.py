@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from text_utils import normalize_text
+
+
+AUDIO_CACHE_DIR = Path(os.getenv("AUDIO_CACHE_DIR", "static/audio"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "512")) * 1024 * 1024
+AUDIO_CACHE_MAX_AGE = float(os.getenv("AUDIO_CACHE_MAX_AGE_HOURS", "72")) * 3600
+AUDIO_CACHE_EVICT_INTERVAL = 60.0
+# A synthesized WAV and the compressed copies the delivery layer keeps next to it (see audio_delivery.py)
+SIBLING_SUFFIXES = (".wav", ".ogg", ".mp3")
+# Every file the cache writes is named like this; eviction touches nothing else
+CACHE_PREFIX = "tts_"
+
+
+class AudioCache:
+    """
+    Content-addressed store for synthesized speech.
+
+    A file's name is a hash of the normalized text plus the voice settings,
+    so identical text is synthesized once and then served from disk.
+    Eviction covers the files the cache wrote (names starting with
+    CACHE_PREFIX, including encoded copies and temp files); anything else in
+    the directory, such as the tracked sample responses, is left alone. Files
+    older than `max_age` go first, then the least recently used ones until
+    the total fits in `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: Path = AUDIO_CACHE_DIR,
+        max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+        max_age: float = AUDIO_CACHE_MAX_AGE,
+        voice_settings: dict | None = None,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.voice_settings = voice_settings or {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, text: str, suffix: str = ".wav") -> Path:
+        payload = json.dumps({"text": normalize_text(text), "voice": self.voice_settings}, sort_keys=True)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{CACHE_PREFIX}{digest}{suffix}"
+
+    def lookup(self, text: str, suffix: str = ".wav") -> Path | None:
+        """Return the cached file for `text`, refreshing its LRU timestamp, or None."""
+        path = self.path_for(text, suffix)
+        if not self.touch(path):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def touch(self, path: Path) -> bool:
+        """
+        Refresh the LRU timestamp of `path` and of the other formats of the same
+        audio, so a WAV and the copy clients download age together; False if
+        `path` does not exist.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        for suffix in SIBLING_SUFFIXES:
+            sibling = path.with_suffix(suffix)
+            if sibling != path:
+                try:
+                    os.utime(sibling)
+                except FileNotFoundError:
+                    pass
+        return True
+
+    def temp_path(self, path: Path) -> Path:
+        """Unique scratch name next to `path`; moved into place once fully written."""
+        return path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.{time.time_ns()}.tmp")
+
+    def maybe_evict(self) -> None:
+        """Evict at most once per AUDIO_CACHE_EVICT_INTERVAL seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_evict < AUDIO_CACHE_EVICT_INTERVAL:
+                return
+            self._last_evict = now
+        self.evict()
+
+    def evict(self) -> dict:
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.directory.glob(f"{CACHE_PREFIX}*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if not path.is_file():
+                continue
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path.suffix == ".tmp":
+                # Still being written by a TTS worker
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return {"removed": removed, "bytes": total}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
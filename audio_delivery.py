@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from audio_cache import AudioCache
+from observability import span
+from tts import audio_cache
+
+
+# Where clients reach this server, e.g. https://mentor.example.com behind a proxy
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://10.7.0.28:5505").rstrip("/")
+# "opus" (OGG/Opus), "mp3", or "wav" to serve the synthesized files as they are
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "opus")
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+AUDIO_ENCODE_WORKERS = int(os.getenv("AUDIO_ENCODE_WORKERS", "2"))
+
+# format -> (file suffix, content type, ffmpeg output options)
+FORMATS = {
+    "opus": (".ogg", "audio/ogg", {"format": "ogg", "acodec": "libopus", "application": "voip"}),
+    "mp3": (".mp3", "audio/mpeg", {"format": "mp3", "acodec": "libmp3lame"}),
+    "wav": (".wav", "audio/wav", None),
+}
+MEDIA_TYPES = {suffix: media_type for suffix, media_type, _ in FORMATS.values()}
+# Names are content hashes, so a given URL always holds the same audio
+IMMUTABLE = "public, max-age=31536000, immutable"
+_NAME = re.compile(r"[\w-]+\.(?:ogg|mp3|wav)")
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+logger = logging.getLogger(__name__)
+
+
+class AudioEncoder:
+    """
+    Compresses synthesized WAV files for delivery.
+
+    `publish` returns the name of the compressed file at once and encodes it
+    with ffmpeg in the background, next to the WAV in the audio cache, so
+    the answer is not held up. A request for a file still being encoded
+    waits for it; one whose WAV is cached but whose encoding is gone (e.g.
+    after a restart or eviction) starts it again. Each file is encoded once.
+    """
+
+    def __init__(
+        self,
+        cache: AudioCache,
+        audio_format: str = AUDIO_FORMAT,
+        bitrate: str = AUDIO_BITRATE,
+        workers: int = AUDIO_ENCODE_WORKERS,
+    ):
+        if audio_format not in FORMATS:
+            raise ValueError(f"AUDIO_FORMAT must be one of {', '.join(FORMATS)}")
+        self.cache = cache
+        self.suffix, self.media_type, options = FORMATS[audio_format]
+        self.options = {**options, "audio_bitrate": bitrate} if options else None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio-encode")
+        self._lock = threading.Lock()
+        self._pending: dict[str, Future] = {}
+        self.encoded = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def publish(self, wav: Path) -> str:
+        """Name under which `wav` is served; its encoding is started in the background."""
+        if self.options is None:
+            return wav.name
+        self.ensure(wav)
+        return wav.with_suffix(self.suffix).name
+
+    def ensure(self, wav: Path) -> Future:
+        """Future resolving to the encoded file, already done if it exists."""
+        target = wav.with_suffix(self.suffix)
+        with self._lock:
+            future = self._pending.get(target.name)
+            if future is not None:
+                return future
+            if target.exists():
+                future = Future()
+                future.set_result(target)
+                return future
+            future = self._pool.submit(self._encode, wav, target)
+            self._pending[target.name] = future
+        future.add_done_callback(lambda _: self._forget(target.name))
+        return future
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def _encode(self, wav: Path, target: Path) -> Path:
+        tmp = self.cache.temp_path(target)
+        try:
+            with span("audio_encode"):
+                ffmpeg.input(str(wav)).output(str(tmp), **self.options).overwrite_output().run(quiet=True)
+            os.replace(tmp, target)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            with self._lock:
+                self.failed += 1
+            # ffmpeg.Error carries ffmpeg's own output
+            detail = e.stderr.decode(errors="replace").strip() if isinstance(e, ffmpeg.Error) and e.stderr else e
+            logger.warning("Encoding %s failed: %s", wav.name, detail)
+            raise
+        with self._lock:
+            self.encoded += 1
+            self.bytes_in += wav.stat().st_size
+            self.bytes_out += target.stat().st_size
+        return target
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "format": self.media_type,
+                "pending": len(self._pending),
+                "encoded": self.encoded,
+                "failed": self.failed,
+                "compression_ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+            }
+
+
+def ranged_file(path: Path, media_type: str, range_header: str | None) -> Response:
+    """
+    The single byte range asked for (206, or 416 when it starts past the end),
+    or the whole file when there is no Range header or it cannot be parsed
+    (RFC 9110 says to ignore it then; multiple ranges are ignored too).
+    """
+    size = path.stat().st_size
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": IMMUTABLE}
+    match = _RANGE.fullmatch((range_header or "").strip())
+    first, last = match.groups() if match else ("", "")
+    if (first, last) == ("", "") or (first and last and int(last) < int(first)):
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # "bytes=-N": the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start + 1)
+    return Response(
+        data, status_code=206, media_type=media_type,
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"},
+    )
+
+
+# Shared by every request in this server process
+audio_encoder = AudioEncoder(audio_cache)
+
+
+def audio_url(path: Path | None) -> str | None:
+    """Public URL of synthesized speech, in the delivery format."""
+    return f"{PUBLIC_BASE_URL}/audio/{audio_encoder.publish(path)}" if path else None
+
+
+def serve_audio(app: FastAPI) -> None:
+    """Add GET /audio/{name}: cached speech with a content type, Range support and long-lived caching."""
+
+    @app.get("/audio/{name}")
+    async def audio(name: str, request: Request):
+        if not _NAME.fullmatch(name):
+            raise HTTPException(status_code=404, detail="Not found")
+        path = audio_encoder.cache.directory / name
+        if not path.exists() and path.suffix == audio_encoder.suffix:
+            source = path.with_suffix(".wav")
+            if not source.exists():
+                raise HTTPException(status_code=404, detail="Not found")
+            try:
+                path = await asyncio.wrap_future(audio_encoder.ensure(source))
+            except Exception:
+                # Uncompressed beats nothing; redirected so the name and content type stay WAV.
+                # Temporary and uncached, as a later request may encode successfully
+                return RedirectResponse(
+                    f"{PUBLIC_BASE_URL}/audio/{source.name}", status_code=307, headers={"Cache-Control": "no-store"}
+                )
+        if not audio_encoder.cache.touch(path):
+            raise HTTPException(status_code=404, detail="Not found")
+        return ranged_file(path, MEDIA_TYPES[path.suffix], request.headers.get("range"))
@@ -0,0 +1,121 @@
+import io
+from math import gcd
+
+import ffmpeg
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+
+# Whisper expects 16 kHz mono float32
+SAMPLE_RATE = 16000
+
+
+def decode_audio_bytes(data: bytes, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode an uploaded audio file entirely in memory.
+    WAV/FLAC/OGG are parsed natively by libsndfile; anything else is piped
+    through ffmpeg's stdin/stdout, so no temporary file is ever written.
+    """
+    try:
+        audio, file_sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    except RuntimeError:
+        return _decode_with_ffmpeg(data, sr)
+
+    audio = audio.mean(axis=1)
+    if file_sr != sr:
+        g = gcd(sr, file_sr)
+        audio = resample_poly(audio, sr // g, file_sr // g)
+    return audio.astype(np.float32, copy=False)
+
+
+def _decode_with_ffmpeg(data: bytes, sr: int) -> np.ndarray:
+    try:
+        out, _ = (
+            ffmpeg.input("pipe:0", threads=0)
+            .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
+            .run(input=data, capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise ValueError(f"Failed to decode audio: {e.stderr.decode(errors='ignore')}") from e
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+class EnergySegmenter:
+    """
+    Lightweight voice-activity segmentation for a stream of samples.
+
+    Audio is split into `frame_ms` frames; a frame is speech when its RMS level
+    is above `threshold_db` dBFS. A segment ends after `min_silence_ms` of
+    silence, or when it reaches `max_segment_s` so it still fits one Whisper
+    window. `padding_ms` of audio before speech onset is kept so first
+    syllables are not clipped. Segments shorter than `min_speech_ms` are dropped.
+    """
+
+    def __init__(
+        self,
+        sr: int = SAMPLE_RATE,
+        frame_ms: int = 30,
+        threshold_db: float = -40.0,
+        min_silence_ms: int = 600,
+        min_speech_ms: int = 250,
+        max_segment_s: float = 25.0,
+        padding_ms: int = 200,
+    ):
+        self.frame = sr * frame_ms // 1000
+        self.threshold = 10 ** (threshold_db / 20)
+        self.silence_frames = max(min_silence_ms // frame_ms, 1)
+        self.min_speech_frames = max(min_speech_ms // frame_ms, 1)
+        self.max_frames = int(max_segment_s * 1000 // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._preroll: list[np.ndarray] = []
+        self._segment: list[np.ndarray] = []
+        self._speech_frames = 0
+        self._silence_run = 0
+
+    def feed(self, samples: np.ndarray) -> list[np.ndarray]:
+        """Add samples; returns segments that ended within them."""
+        self._pending = np.concatenate([self._pending, samples.astype(np.float32, copy=False)])
+        n = len(self._pending) // self.frame
+        frames = self._pending[:n * self.frame].reshape(n, self.frame)
+        self._pending = self._pending[n * self.frame:]
+
+        done = []
+        for frame in frames:
+            is_speech = np.sqrt(np.mean(frame * frame)) >= self.threshold
+            if not self._segment:
+                if is_speech:
+                    self._segment = self._preroll + [frame]
+                    self._preroll = []
+                    self._speech_frames = 1
+                    self._silence_run = 0
+                else:
+                    self._preroll = (self._preroll + [frame])[-self.padding_frames:] if self.padding_frames else []
+                continue
+
+            self._segment.append(frame)
+            if is_speech:
+                self._speech_frames += 1
+                self._silence_run = 0
+            else:
+                self._silence_run += 1
+            if self._silence_run >= self.silence_frames or len(self._segment) >= self.max_frames:
+                segment = self._close()
+                if segment is not None:
+                    done.append(segment)
+        return done
+
+    def flush(self) -> np.ndarray | None:
+        """End of stream: return the segment in progress, if it holds enough speech."""
+        if self._segment and len(self._pending):
+            self._segment.append(self._pending)
+        self._pending = np.zeros(0, dtype=np.float32)
+        return self._close() if self._segment else None
+
+    def _close(self) -> np.ndarray | None:
+        segment, speech = self._segment, self._speech_frames
+        self._segment, self._speech_frames, self._silence_run = [], 0, 0
+        if speech < self.min_speech_frames:
+            return None
+        return np.concatenate(segment)
@@ -0,0 +1,336 @@
+"""
+End-to-end load test for the API servers, runnable offline on a CPU-only box.
+
+Starts the stub Ollama server, optionally times ingestion of a PDF into a
+scratch Chroma directory, launches `uvicorn <app>:app` with the stub LLM and
+stub TTS, waits for /health, then drives a mix of text (/ask) and voice
+(/voice-ask) requests at each concurrency level. Every virtual user keeps
+its own session, so history compaction and rewriting are exercised too.
+
+Per level and request kind the results file has p50/p95/p99 latency,
+throughput, error counts and the per-stage breakdown from each response's
+`timings`, plus the server's own /…/stats after the level.
+
+    python bench/run.py --app new_agent --concurrency 1,4,8 --requests 40 --voice-ratio 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from stub_ollama import StubOllama
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "bench" / "results"
+DEFAULT_VOICE_FILES = ["test_voice.mp3", *sorted(str(p.relative_to(REPO_ROOT)) for p in (REPO_ROOT / "static" / "audio").glob("response_*.wav"))]
+QUESTIONS = [
+    "I want to open a small bakery in my neighbourhood. Where should I start?",
+    "How do I validate demand for a subscription box for pet owners?",
+    "What are the first legal steps to register a software consultancy?",
+    "How much money should I raise before launching a mobile app?",
+    "How can I find a co-founder with complementary skills?",
+    "What metrics should an early stage e-commerce store track every week?",
+    "How do I price a B2B service when I have no clients yet?",
+    "Tell me more about that.",
+    "What are common mistakes first-time founders make with cash flow?",
+    "How should I pitch my idea to angel investors?",
+    "Can you explain the lean startup approach in simple terms?",
+    "What can I do to keep my first customers coming back?",
+]
+STATS_ENDPOINTS = [
+    "/llm/stats", "/tts/stats", "/whisper/stats", "/embeddings/stats",
+    "/cache/stats", "/context/stats", "/rewrite/stats", "/prefetch/stats", "/models",
+]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Linear-interpolated percentile (as numpy's default) of `values`, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def distribution(values: list[float]) -> dict:
+    def r(value):
+        return round(value, 4) if value is not None else None
+
+    return {
+        "mean": r(sum(values) / len(values)) if values else None,
+        "p50": r(percentile(values, 50)),
+        "p95": r(percentile(values, 95)),
+        "p99": r(percentile(values, 99)),
+        "max": r(max(values)) if values else None,
+    }
+
+
+def summarize(records: list[dict], elapsed: float) -> dict:
+    ok = [r for r in records if r["status"] == 200]
+    errors: dict[str, int] = {}
+    for r in records:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    stages = sorted({stage for r in ok for stage in r["timings"]})
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": errors,
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "latency_s": distribution([r["latency"] for r in ok]),
+        "stages_s": {
+            stage: distribution([r["timings"][stage] for r in ok if stage in r["timings"]])
+            for stage in stages
+        },
+    }
+
+
+class LoadGenerator:
+    """Closed-loop load: `concurrency` virtual users, each sending its next request when the last one returns."""
+
+    def __init__(self, base_url: str, questions: list[str], voice_files: list[Path], voice_ratio: float, seed: int, timeout: float):
+        self.base_url = base_url
+        self.questions = questions
+        self.voice = [(path.name, path.read_bytes()) for path in voice_files]
+        self.voice_ratio = voice_ratio if self.voice else 0.0
+        self.random = random.Random(seed)
+        self.timeout = timeout
+
+    async def request(self, client: httpx.AsyncClient, kind: str, session_id: str) -> dict:
+        start = time.perf_counter()
+        try:
+            if kind == "voice":
+                name, data = self.random.choice(self.voice)
+                response = await client.post("/voice-ask", files={"file": (name, data)}, data={"session_id": session_id})
+            else:
+                query = self.random.choice(self.questions)
+                response = await client.post("/ask", json={"query": query, "session_id": session_id})
+            status = response.status_code
+            body = response.json() if status == 200 else {}
+        except httpx.HTTPError as e:
+            status, body = type(e).__name__, {}
+        return {
+            "kind": kind,
+            "status": status,
+            "latency": time.perf_counter() - start,
+            "timings": body.get("timings") or {},
+        }
+
+    def next_kind(self) -> str:
+        return "voice" if self.random.random() < self.voice_ratio else "text"
+
+    async def run(self, concurrency: int, total: int, run_id: str) -> tuple[list[dict], float]:
+        remaining = total
+        records: list[dict] = []
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async def user(index: int, client: httpx.AsyncClient) -> None:
+            nonlocal remaining
+            session_id = f"bench-{run_id}-c{concurrency}-u{index}"
+            while remaining > 0:
+                remaining -= 1
+                records.append(await self.request(client, self.next_kind(), session_id))
+
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(user(i, client) for i in range(concurrency)))
+            return records, time.perf_counter() - start
+
+    async def server_stats(self) -> dict:
+        stats = {}
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30) as client:
+            for path in STATS_ENDPOINTS:
+                try:
+                    response = await client.get(path)
+                except httpx.HTTPError:
+                    continue
+                if response.status_code == 200:
+                    stats[path] = response.json()
+        return stats
+
+
+def time_ingestion(pdfs: list[str], env: dict, workers: int) -> dict:
+    """Time a cold ingest into the scratch directory, then a re-run where every PDF is unchanged."""
+    results = {"pdfs": pdfs}
+    for phase in ("cold", "unchanged"):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "ingest.py", *pdfs, "--workers", str(workers)],
+            cwd=REPO_ROOT, env=env, check=True,
+        )
+        results[f"{phase}_s"] = round(time.perf_counter() - start, 3)
+        print(f"Ingestion ({phase}): {results[f'{phase}_s']}s")
+    return results
+
+
+def wait_until_healthy(base_url: str, server: subprocess.Popen, timeout: float, log_path: Path) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}; see {log_path}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=5).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"Server not healthy after {timeout:.0f}s; see {log_path}")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test an API server against a stub LLM and stub TTS.")
+    parser.add_argument("--app", choices=["new_agent", "agent"], default="new_agent")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=4, help="unrecorded requests before the first level")
+    parser.add_argument("--voice-ratio", type=float, default=0.25, help="share of requests sent to /voice-ask")
+    parser.add_argument("--voice-file", action="append", help=f"recording to upload (default: {', '.join(DEFAULT_VOICE_FILES)})")
+    parser.add_argument("--pdf", action="append", help="PDF to ingest into the scratch collection (default: data/book_2.pdf)")
+    parser.add_argument("--skip-ingest", action="store_true", help="use the existing ./chroma_db instead of a scratch collection")
+    parser.add_argument("--ingest-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--whisper-model", default="base", help="Whisper model to load (must already be downloaded)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--ttft-ms", type=float, default=150, help="stub LLM delay before the first token")
+    parser.add_argument("--prompt-ms-per-1k-chars", type=float, default=20, help="stub LLM delay per 1,000 prompt characters")
+    parser.add_argument("--tokens-per-second", type=float, default=40, help="stub LLM generation speed")
+    parser.add_argument("--answer-words", type=int, default=120, help="length of the stub LLM's answers")
+    parser.add_argument("--ollama-parallel", type=int, default=2, help="generations the stub LLM serves at once")
+    parser.add_argument("--tts-ms-per-word", type=float, default=5, help="stub TTS synthesis time per word")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server setting, e.g. SEMANTIC_CACHE=1")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="results file (default: bench/results/<app>-<timestamp>.json)")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the scratch directory and server log")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    voice_files = [REPO_ROOT / path for path in (args.voice_file or DEFAULT_VOICE_FILES)]
+    pdfs = args.pdf or ["data/book_2.pdf"]
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    out_path = args.out or RESULTS_DIR / f"{args.app}-{run_id}.json"
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    log_path = workdir / "server.log"
+
+    stub = StubOllama(
+        port=args.ollama_port,
+        ttft_ms=args.ttft_ms,
+        prompt_ms_per_1k_chars=args.prompt_ms_per_1k_chars,
+        tokens_per_second=args.tokens_per_second,
+        answer_words=args.answer_words,
+        parallel=args.ollama_parallel,
+    ).start()
+    env = {
+        **os.environ,
+        "OLLAMA_BASE_URL": stub.base_url,
+        "OLLAMA_MODEL": stub.model,
+        "TTS_BACKEND": "stub",
+        "TTS_STUB_MS_PER_WORD": str(args.tts_ms_per_word),
+        "WHISPER_MODEL": args.whisper_model,
+        # Start with empty caches and sessions, and leave the real ones alone
+        "AUDIO_CACHE_DIR": str(workdir / "audio"),
+        "SESSION_DB_URL": f"sqlite:///{workdir / 'sessions.db'}",
+        # Models must already be in the local caches: never reach for the network
+        "HF_HUB_OFFLINE": "1",
+        "TRANSFORMERS_OFFLINE": "1",
+        "PYTHONUNBUFFERED": "1",
+    }
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+
+    results = {
+        "run_id": run_id,
+        "config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "commit": git_commit(),
+        },
+        "levels": [],
+    }
+    server = None
+    finished = False
+    try:
+        if args.app == "new_agent" and not args.skip_ingest:
+            env["CHROMA_PERSIST_DIRECTORY"] = str(workdir / "chroma_db")
+            results["ingestion"] = time_ingestion(pdfs, env, args.ingest_workers)
+
+        base_url = f"http://127.0.0.1:{args.port}"
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", f"{args.app}:app", "--host", "127.0.0.1", "--port", str(args.port)],
+                cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        results["startup_s"] = round(wait_until_healthy(base_url, server, args.startup_timeout, log_path), 3)
+        print(f"{args.app} healthy after {results['startup_s']}s")
+
+        generator = LoadGenerator(base_url, QUESTIONS, voice_files, args.voice_ratio, args.seed, args.timeout)
+        if args.warmup:
+            asyncio.run(generator.run(1, args.warmup, f"{run_id}-warmup"))
+
+        for concurrency in levels:
+            records, elapsed = asyncio.run(generator.run(concurrency, args.requests, run_id))
+            level = {
+                "concurrency": concurrency,
+                "elapsed_s": round(elapsed, 3),
+                "all": summarize(records, elapsed),
+                **{kind: summarize([r for r in records if r["kind"] == kind], elapsed) for kind in ("text", "voice")},
+                "server_stats": asyncio.run(generator.server_stats()),
+            }
+            results["levels"].append(level)
+            latency = level["all"]["latency_s"]
+            rewrites = level["server_stats"].get("/rewrite/stats", {})
+            print(
+                f"concurrency={concurrency:<3} ok={level['all']['ok']}/{len(records)} "
+                f"rps={level['all']['throughput_rps']} p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s"
+                + (f" rewrite_skip_rate={rewrites['skip_rate']}" if "skip_rate" in rewrites else "")
+            )
+        results["stub_llm_requests"] = stub.requests
+        finished = True
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        stub.stop()
+        if args.keep_workdir or not finished:
+            print(f"Scratch directory and server log kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
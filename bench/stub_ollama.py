@@ -0,0 +1,267 @@
+"""
+Stand-in for a local Ollama server, for benchmarks that must run offline.
+
+Implements the endpoints the API servers use (/api/chat, /api/generate,
+/api/ps, /api/tags, /api/version) with Ollama's streaming NDJSON format.
+Answers are canned but shaped like the mentor prompt asks for, including
+the "Next Interaction Prompts" block, so parsing, suggestion streaming and
+TTS see realistic input. Latency is modelled as a fixed time to first token,
+a cost per 1,000 prompt characters and a steady token rate, with at most
+`parallel` generations running at once like OLLAMA_NUM_PARALLEL.
+
+    python bench/stub_ollama.py --port 11435
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+BODY_SENTENCES = [
+    "Start by writing down who your first ten customers are and what problem costs them the most.",
+    "Talk to them before you build anything, and ask how they solve the problem today.",
+    "Turn what you hear into the smallest offer you could deliver by hand this month.",
+    "Price it so that a handful of sales would cover your costs, then try to make those sales.",
+    "Track every conversation and every objection, because they tell you what to fix next.",
+    "Once people pay without heavy persuasion, look for the steps you can standardize or automate.",
+]
+SUGGESTIONS = [
+    "How do I find my first ten customers?",
+    "What should I ask in customer interviews?",
+    "How do I price an early offer?",
+]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def mentor_answer(question: str, words: int) -> str:
+    """A canned answer of about `words` words in the mentor bot's response format."""
+    topic = " ".join(question.split()[:12]).rstrip("?.!") or "your idea"
+    sentences = [f"Let's look at {topic}."]
+    i = 0
+    while len(" ".join(sentences).split()) < words:
+        sentences.append(BODY_SENTENCES[i % len(BODY_SENTENCES)])
+        i += 1
+    suggestions = "\n".join(f"{n}. {s}" for n, s in enumerate(SUGGESTIONS, 1))
+    return (
+        " ".join(sentences)
+        + "\n\n**Interactive Engagement Question:** Which of these steps feels hardest for you right now?"
+        + f"\n\n**Next Interaction Prompts:**\n{suggestions}"
+    )
+
+
+def reply_for(prompt: str, last_user: str, words: int) -> str:
+    """Pick the reply from the kind of prompt: question rewrite, history summary or a mentor answer."""
+    if "standalone question" in prompt:
+        return last_user
+    if "running summary" in prompt:
+        return "The user is validating an early business idea and wants practical next steps."
+    question = re.sub(r"^\s*Query:\s*", "", last_user)
+    return mentor_answer(question, words)
+
+
+def tokens(text: str) -> list[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class StubOllama:
+    """Threaded HTTP server speaking enough of the Ollama API for the API servers."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 11435,
+        model: str = os.getenv("OLLAMA_MODEL", "llama3.2:3B"),
+        ttft_ms: float = 150,
+        prompt_ms_per_1k_chars: float = 20,
+        tokens_per_second: float = 40,
+        answer_words: int = 120,
+        parallel: int = 2,
+    ):
+        self.model = model
+        self.ttft = ttft_ms / 1000
+        self.prompt_cost = prompt_ms_per_1k_chars / 1000 / 1000
+        self.token_delay = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.answer_words = answer_words
+        self._slots = threading.Semaphore(parallel)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllama":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def generate(self, prompt: str, last_user: str, options: dict):
+        """Yield reply tokens at the configured pace, holding one of the `parallel` slots."""
+        with self._lock:
+            self.requests += 1
+        reply = tokens(reply_for(prompt, last_user, self.answer_words))
+        limit = options.get("num_predict")
+        if isinstance(limit, int) and limit > 0:
+            reply = reply[:limit]
+        with self._slots:
+            time.sleep(self.ttft + len(prompt) * self.prompt_cost)
+            for i, token in enumerate(reply):
+                if i:
+                    time.sleep(self.token_delay)
+                yield token
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, body: dict, status: int = 200) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, chunks) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    line = json.dumps(chunk).encode("utf-8") + b"\n"
+                    self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                model = {
+                    "name": stub.model,
+                    "model": stub.model,
+                    "size": 0,
+                    "digest": "stub",
+                    "details": {"format": "gguf", "family": "stub"},
+                }
+                if self.path == "/api/ps":
+                    self._json({"models": [{**model, "expires_at": "2318-01-01T00:00:00Z", "size_vram": 0}]})
+                elif self.path == "/api/tags":
+                    self._json({"models": [{**model, "modified_at": _now()}]})
+                elif self.path == "/api/version":
+                    self._json({"version": "0.0.0-stub"})
+                else:
+                    self._json({"status": "Ollama is running"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/chat":
+                    self._respond(request, chat=True)
+                elif self.path == "/api/generate":
+                    self._respond(request, chat=False)
+                else:
+                    self._json({"error": f"{self.path} is not implemented by the stub"}, status=404)
+
+            def _respond(self, request: dict, chat: bool) -> None:
+                model = request.get("model") or stub.model
+                if chat:
+                    messages = request.get("messages") or []
+                    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+                    users = [m for m in messages if m.get("role") == "user"]
+                    last_user = str(users[-1].get("content", "")) if users else ""
+                else:
+                    prompt = request.get("prompt") or ""
+                    # OllamaLLM flattens the chat prompt into "Human: ..." lines
+                    turns = re.findall(r"Human:\s*(.*)", prompt)
+                    last_user = turns[-1] if turns else prompt
+                started = time.perf_counter()
+                pieces = stub.generate(prompt, last_user, request.get("options") or {})
+
+                def chunk(text: str) -> dict:
+                    body = {"model": model, "created_at": _now(), "done": False}
+                    if chat:
+                        body["message"] = {"role": "assistant", "content": text}
+                    else:
+                        body["response"] = text
+                    return body
+
+                def final(count: int) -> dict:
+                    body = chunk("")
+                    body.update({
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int((time.perf_counter() - started) * 1e9),
+                        "prompt_eval_count": len(prompt) // 4,
+                        "eval_count": count,
+                    })
+                    return body
+
+                if request.get("stream", True):
+                    def events():
+                        count = 0
+                        for piece in pieces:
+                            count += 1
+                            yield chunk(piece)
+                        yield final(count)
+
+                    self._stream(events())
+                else:
+                    text = list(pieces)
+                    body = final(len(text))
+                    if chat:
+                        body["message"]["content"] = "".join(text)
+                    else:
+                        body["response"] = "".join(text)
+                    self._json(body)
+
+        return Handler
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a stub Ollama API for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL", "llama3.2:3B"))
+    parser.add_argument("--ttft-ms", type=float, default=150, help="fixed delay before the first token")
+    parser.add_argument("--prompt-ms-per-1k-chars", type=float, default=20, help="extra delay per 1,000 prompt characters")
+    parser.add_argument("--tokens-per-second", type=float, default=40)
+    parser.add_argument("--answer-words", type=int, default=120)
+    parser.add_argument("--parallel", type=int, default=2, help="generations served at once")
+    args = parser.parse_args(argv)
+
+    stub = StubOllama(
+        args.host, args.port, args.model, args.ttft_ms, args.prompt_ms_per_1k_chars,
+        args.tokens_per_second, args.answer_words, args.parallel,
+    )
+    print(f"Stub Ollama serving {args.model} on {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Recall, latency and memory of the quantized vector index against Chroma.
+
+Builds the int8 index from the persisted Chroma collection into a scratch
+directory, then runs the same query set against Chroma and against the
+quantized store at several rescore factors. Queries are snippets sampled
+from the chunks themselves; the ground truth is an exact float search over
+every chunk vector. Per backend the results file has recall@k, p50/p95
+search latency and the bytes each backend needs to serve a query, including
+the chunk texts and metadata that come back with the results.
+
+    python ingest.py
+    python bench/vector_store.py --queries 200 --k 3,10 --rescore 1,2,4,8
+"""
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from run import RESULTS_DIR, REPO_ROOT, distribution, git_commit
+
+sys.path.insert(0, str(REPO_ROOT))
+
+from ingest import EMBEDDING_MODEL, PERSIST_DIRECTORY, open_vectorstore  # noqa: E402
+from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings  # noqa: E402
+from quantized_store import QuantizedVectorStore  # noqa: E402
+
+
+def sample_queries(texts: list[str], count: int, words: int, seed: int) -> list[str]:
+    """Runs of `words` consecutive words from randomly chosen chunks."""
+    rng = random.Random(seed)
+    queries = []
+    for text in rng.choices(texts, k=count):
+        tokens = text.split()
+        start = rng.randrange(max(len(tokens) - words, 0) + 1)
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def directory_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def measure(search, vectors: np.ndarray, truth: list[list[str]], k: int) -> dict:
+    """Recall@k against `truth` and per-query latency of `search(vector, k) -> ids`."""
+    latencies, hits = [], 0
+    for vector, expected in zip(vectors, truth):
+        start = time.perf_counter()
+        found = search(vector.tolist(), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found) & set(expected[:k]))
+    return {
+        "recall": round(hits / (k * len(truth)), 4),
+        "latency_ms": distribution(latencies),
+    }
+
+
+def parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the quantized vector index with Chroma.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-words", type=int, default=12, help="words per sampled query snippet")
+    parser.add_argument("--k", default="3,10", help="comma-separated result counts")
+    parser.add_argument("--rescore", default="1,2,4,8", help="comma-separated rescore factors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="results file (default: bench/results/vector-store-<timestamp>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    ks = [int(k) for k in args.k.split(",") if k.strip()]
+    factors = [int(f) for f in args.rescore.split(",") if f.strip()]
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    out_path = args.out or RESULTS_DIR / f"vector-store-{run_id}.json"
+    workdir = Path(tempfile.mkdtemp(prefix="bench-quantized-"))
+
+    embeddings = SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL)
+    chroma = open_vectorstore(embeddings)
+    try:
+        start = time.perf_counter()
+        QuantizedVectorStore.build(chroma, workdir / "index")
+        build_s = time.perf_counter() - start
+        store = QuantizedVectorStore.load(workdir / "index", embeddings)
+        count, dim = store.codes.shape
+        print(f"Quantized {count} chunks x {dim} dims in {build_s:.1f}s")
+
+        queries = sample_queries(store.texts, args.queries, args.query_words, args.seed)
+        vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Exact float search over every chunk is the reference
+        full = np.asarray(store.vectors)
+        truth = [[store.ids[row] for row in np.argsort(-(full @ v))[:max(ks)]] for v in vectors]
+
+        backends = {
+            "chroma": lambda v, k: [
+                doc.id for doc, _ in chroma.similarity_search_by_vector_with_relevance_scores(v, k=k)
+            ],
+            **{
+                f"quantized_rescore_{f}": (lambda f: lambda v, k: [
+                    store.ids[row] for row, _ in store.search(v, k, rescore=f)
+                ])(f)
+                for f in factors
+            },
+        }
+        results = {
+            "run_id": run_id,
+            "config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            "environment": {"commit": git_commit(), "embedding_model": EMBEDDING_MODEL},
+            "corpus": {"chunks": int(count), "dim": int(dim), "build_s": round(build_s, 3)},
+            "memory_bytes": {
+                # Chroma's HNSW index keeps every float vector in memory in each process
+                "chroma_float_vectors": int(count * dim * 4),
+                "chroma_on_disk": directory_bytes(Path(PERSIST_DIRECTORY)),
+                # Scanned on every query; the float file is only touched for rescored rows
+                "quantized_hot": store.stats()["int8_bytes"],
+                "quantized_cold": store.stats()["float_bytes"],
+                # Chunk texts and metadata: mapped and decoded per returned row, plus the id list each worker parses
+                "quantized_docs": store.stats()["docs_bytes"],
+                "quantized_ids": len(json.dumps(store.ids)),
+            },
+            "backends": {},
+        }
+        for name, search in backends.items():
+            search(vectors[0].tolist(), max(ks))  # warm up
+            results["backends"][name] = {f"k={k}": measure(search, vectors, truth, k) for k in ks}
+
+        for name, by_k in results["backends"].items():
+            cells = "  ".join(
+                f"{label}: recall={m['recall']:.3f} p50={m['latency_ms']['p50']}ms p95={m['latency_ms']['p95']}ms"
+                for label, m in by_k.items()
+            )
+            print(f"{name:<22} {cells}")
+        memory = results["memory_bytes"]
+        print(
+            f"memory: chroma float {memory['chroma_float_vectors'] / 2**20:.1f} MiB, "
+            f"quantized hot {memory['quantized_hot'] / 2**20:.1f} MiB + cold {memory['quantized_cold'] / 2**20:.1f} MiB"
+            f" + docs {memory['quantized_docs'] / 2**20:.1f} MiB + ids {memory['quantized_ids'] / 2**20:.1f} MiB"
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
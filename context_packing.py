@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+from typing import Callable
+
+import numpy as np
+from langchain_core.documents import Document
+
+from text_utils import estimate_tokens
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1024"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.95"))
+
+logger = logging.getLogger(__name__)
+
+
+# Characters of stripped whitespace allowed between two chunks that still count as neighbours
+ADJACENT_GAP = 4
+
+
+def _span(doc: Document) -> tuple[int, int] | None:
+    start = doc.metadata.get("start_index")
+    return (start, start + len(doc.page_content)) if isinstance(start, int) else None
+
+
+def _merge_adjacent(group: list[Document]) -> list[Document]:
+    """
+    Chunks of one page in reading order, neighbours joined into one passage
+    without the text the splitter repeated between them. Chunks without a
+    `start_index` (collections ingested before it was stored) are kept as they are.
+    """
+    if any(_span(doc) is None for doc in group):
+        return group
+    passages: list[Document] = []
+    text, end = "", -1
+    for doc in sorted(group, key=lambda d: d.metadata["start_index"]):
+        start, doc_end = _span(doc)
+        if passages and start <= end + ADJACENT_GAP:
+            if doc_end > end:
+                text += doc.page_content[end - start:] if start < end else " " + doc.page_content
+                end = doc_end
+            passages[-1] = Document(page_content=text, metadata=passages[-1].metadata)
+            continue
+        text, end = doc.page_content, doc_end
+        passages.append(doc)
+    return passages
+
+
+class ContextPacker:
+    """
+    Assembles the retrieved chunks into the prompt's context within a token budget.
+
+      - near-duplicates (cosine similarity of their stored embeddings at least
+        `duplicate_threshold`) are dropped, keeping the more relevant one
+      - neighbouring chunks from the same page are merged into one passage in
+        reading order, with the splitter's overlap between them removed
+      - passages are added in relevance order until `token_budget` is used up;
+        the most relevant one is truncated if it alone is over budget
+
+    `embeddings_for(docs)` returns one vector per document.
+    """
+
+    def __init__(
+        self,
+        embeddings_for: Callable[[list[Document]], list],
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+    ):
+        self.embeddings_for = embeddings_for
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.duplicates = 0
+
+    def _dedupe(self, docs: list[Document]) -> list[Document]:
+        if len(docs) < 2:
+            return docs
+        matrix = np.asarray(self.embeddings_for(docs), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        kept: list[int] = []
+        for i in range(len(docs)):
+            if not kept or float(np.max(matrix[kept] @ matrix[i])) < self.duplicate_threshold:
+                kept.append(i)
+        return [docs[i] for i in kept]
+
+    def _merge_pages(self, docs: list[Document]) -> list[Document]:
+        """Passages of adjacent chunks per (source, page), positioned where that page first appeared in the ranking."""
+        pages: dict[tuple, list[Document]] = {}
+        for doc in docs:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            if key == (None, None):
+                key = ("", id(doc))
+            pages.setdefault(key, []).append(doc)
+        merged = []
+        for group in pages.values():
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.extend(_merge_adjacent(group))
+        return merged
+
+    def pack(self, docs: list[Document]) -> list[Document]:
+        """Return the documents to stuff into the prompt, most relevant first."""
+        tokens_in = sum(estimate_tokens(doc.page_content) for doc in docs)
+        unique = self._dedupe(docs)
+
+        packed, budget = [], self.token_budget
+        for doc in self._merge_pages(unique):
+            cost = estimate_tokens(doc.page_content)
+            if cost <= budget:
+                packed.append(doc)
+                budget -= cost
+            elif not packed:
+                packed.append(Document(page_content=doc.page_content[:budget * 4], metadata=doc.metadata))
+                budget = 0
+        tokens_out = sum(estimate_tokens(doc.page_content) for doc in packed)
+
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.duplicates += len(docs) - len(unique)
+        logger.info(
+            "Context packing: %d chunks -> %d passages, %d -> %d tokens (%d saved)",
+            len(docs), len(packed), tokens_in, tokens_out, tokens_in - tokens_out,
+        )
+        return packed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out,
+                "duplicates_dropped": self.duplicates,
+            }
+
+
+def stored_embeddings(vectorstore, embeddings) -> Callable[[list[Document]], list]:
+    """
+    Look up the vectors Chroma already holds for the documents by chunk id,
+    embedding only those it does not have (e.g. documents without an id).
+    """
+    def embeddings_for(docs: list[Document]) -> list:
+        ids = [doc.id for doc in docs if doc.id]
+        found = {}
+        if ids:
+            data = vectorstore.get(ids=ids, include=["embeddings"])
+            found = dict(zip(data["ids"], data["embeddings"]))
+        missing = [doc for doc in docs if doc.id not in found]
+        if missing:
+            computed = embeddings.embed_documents([doc.page_content for doc in missing])
+            found.update({id(doc): vector for doc, vector in zip(missing, computed)})
+        return [found[doc.id] if doc.id in found else found[id(doc)] for doc in docs]
+
+    return embeddings_for
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import threading
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Tracks which components of a server are warm.
+
+    Components are registered up front and marked ready once loaded. A
+    component can also have a live `check` that must keep passing (e.g. the
+    LLM model still being resident) for it to count as ready.
+    """
+
+    def __init__(self, components: list[str]):
+        self._lock = threading.Lock()
+        self._state = {name: "starting" for name in components}
+        self._checks: dict[str, Callable[[], bool]] = {}
+
+    def ready(self, name: str, check: Callable[[], bool] | None = None) -> None:
+        with self._lock:
+            self._state[name] = "ready"
+            if check is not None:
+                self._checks[name] = check
+
+    def failed(self, name: str, error: Exception) -> None:
+        with self._lock:
+            self._state[name] = f"failed: {error}"
+
+    def status(self) -> tuple[bool, dict]:
+        """Blocking (runs live checks): (all ready, state per component)."""
+        with self._lock:
+            state = dict(self._state)
+            checks = dict(self._checks)
+        for name, check in checks.items():
+            if state[name] == "ready" and not check():
+                state[name] = "not responding"
+        return all(value == "ready" for value in state.values()), state
+
+
+async def warm(
+    readiness: Readiness,
+    name: str,
+    load: Callable[[], object],
+    check: Callable[[], bool] | None = None,
+    retry_every: float | None = None,
+) -> None:
+    """Run the blocking `load` off the event loop and record the outcome; optionally retry until it succeeds."""
+    while True:
+        try:
+            await asyncio.to_thread(load)
+        except Exception as e:
+            readiness.failed(name, e)
+            logger.warning("Warm-up of %s failed: %s", name, e)
+            if retry_every is None:
+                return
+            await asyncio.sleep(retry_every)
+            continue
+        readiness.ready(name, check)
+        return
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from llm_scheduler import BACKGROUND, llm_config
+from text_utils import estimate_tokens
+
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+HISTORY_SUMMARY_SESSIONS = int(os.getenv("HISTORY_SUMMARY_SESSIONS", "1000"))
+
+logger = logging.getLogger(__name__)
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You maintain a running summary of a conversation between an aspiring entrepreneur and a mentor. "
+               "Update the summary with the new lines. Keep the user's goals, business details, decisions and open "
+               "questions. Reply with the updated summary only, in at most 120 words."),
+    ("human", "Current summary:\n{summary}\n\nNew lines:\n{lines}"),
+])
+
+
+def _fingerprint(message: BaseMessage) -> str:
+    return hashlib.sha1(f"{message.type}\0{message.content}".encode("utf-8")).hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Keeps the prompt's history within a fixed token budget.
+
+    The last `keep_turns` exchanges are sent verbatim. Older messages are
+    folded into a running summary per session. The summary is updated
+    incrementally on a background thread after each turn, so no request
+    waits for it. Messages not yet folded in are sent verbatim for as long
+    as they fit in the budget.
+    """
+
+    def __init__(
+        self,
+        llm,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_turns: int = HISTORY_KEEP_TURNS,
+        max_sessions: int = HISTORY_SUMMARY_SESSIONS,
+    ):
+        self.summary_chain = summary_prompt | llm | StrOutputParser()
+        self.token_budget = token_budget
+        self.keep_messages = keep_turns * 2
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session_id -> (summary, fingerprint of the last message folded into it)
+        self._summaries: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._updating: set[str] = set()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    def _split(self, session_id: str, messages: list[BaseMessage]) -> tuple[str, list[BaseMessage], list[BaseMessage]]:
+        """(summary, older messages not in the summary yet, recent verbatim messages)."""
+        recent = messages[-self.keep_messages:] if self.keep_messages else []
+        older = messages[:len(messages) - len(recent)]
+        with self._lock:
+            summary, anchor = self._summaries.get(session_id, ("", ""))
+            if session_id in self._summaries:
+                self._summaries.move_to_end(session_id)
+        for i in range(len(older) - 1, -1, -1):
+            if _fingerprint(older[i]) == anchor:
+                return summary, older[i + 1:], recent
+        # Anchor scrolled out of the stored window: everything older is newer than the summary
+        return summary, older, recent
+
+    def compact(self, session_id: str, messages: Sequence[BaseMessage]) -> list[BaseMessage]:
+        summary, pending, recent = self._split(session_id, list(messages))
+        budget = self.token_budget
+        head: list[BaseMessage] = []
+        if summary:
+            head = [SystemMessage(content=f"Summary of the earlier conversation: {summary}")]
+            budget -= estimate_tokens(summary)
+
+        # Newest messages win: fill the budget backwards, recent turns first
+        kept: list[BaseMessage] = []
+        for message in reversed(pending + recent):
+            cost = estimate_tokens(str(message.content))
+            if cost > budget and len(kept) >= 2:
+                break
+            kept.append(message)
+            budget -= cost
+        return head + kept[::-1]
+
+    def schedule_update(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Fold messages that left the verbatim window into the summary, off the request path."""
+        _, pending, _ = self._split(session_id, list(messages))
+        if not pending:
+            return
+        with self._lock:
+            if session_id in self._updating:
+                return
+            self._updating.add(session_id)
+        self._pool.submit(self._update, session_id, pending)
+
+    def _update(self, session_id: str, pending: list[BaseMessage]) -> None:
+        try:
+            with self._lock:
+                summary, _ = self._summaries.get(session_id, ("", ""))
+            lines = "\n".join(f"{m.type}: {m.content}" for m in pending)
+            summary = self.summary_chain.invoke(
+                {"summary": summary or "(none)", "lines": lines}, config=llm_config(session_id, BACKGROUND)
+            ).strip()
+            with self._lock:
+                self._summaries[session_id] = (summary, _fingerprint(pending[-1]))
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > self.max_sessions:
+                    self._summaries.popitem(last=False)
+        except Exception as e:
+            logger.warning("History summary update failed for %s: %s", session_id, e)
+        finally:
+            with self._lock:
+                self._updating.discard(session_id)
+
+
+class CompactedHistory(BaseChatMessageHistory):
+    """History view for RunnableWithMessageHistory: reads are compacted, writes go to the real history."""
+
+    def __init__(self, history: BaseChatMessageHistory, compactor: HistoryCompactor, session_id: str):
+        self.history = history
+        self.compactor = compactor
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.compactor.compact(self.session_id, self.history.messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+        self.compactor.schedule_update(self.session_id, self.history.messages)
+
+    def clear(self) -> None:
+        self.history.clear()
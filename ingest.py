@@ -0,0 +1,370 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import fitz
+from langchain_chroma import Chroma
+from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from lexical_index import BM25Index
+from quantized_store import QuantizedVectorStore
+
+
+# Shared ingestion settings (the API server opens the same collection)
+COLLECTION_NAME = "my_collection"
+PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 20
+MANIFEST_PATH = Path(PERSIST_DIRECTORY) / "ingest_manifest.json"
+LEXICAL_INDEX_PATH = Path(PERSIST_DIRECTORY) / "bm25_index.json"
+QUANTIZED_INDEX_DIR = Path(PERSIST_DIRECTORY) / "quantized"
+# "chroma", or "quantized" for the memory-mapped int8 index (see quantized_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# 2: chunks carry the splitter's `start_index` (their offset in the page), used to merge neighbours
+MANIFEST_VERSION = 2
+EMBED_BATCH_SIZE = 256
+# Smallest page range handed to one parsing process; larger PDFs are split across workers
+MIN_PAGES_PER_TASK = 16
+PDF_PATHS = ["data/book_2.pdf"]
+
+logger = logging.getLogger(__name__)
+
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        add_start_index=True,
+    )
+
+
+def file_sha256(path: str | Path) -> str:
+    """Hash a file in 1 MiB blocks so large books never sit fully in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_ids(chunks) -> list[str]:
+    """
+    Stable per-chunk ids derived from source, page and content.
+    Identical chunks on the same page get an occurrence suffix so ids stay unique.
+    """
+    seen: dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        key = "\0".join((
+            str(chunk.metadata.get("source", "")),
+            str(chunk.metadata.get("page", "")),
+            chunk.page_content,
+        ))
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+    return ids
+
+
+def load_pdf_pages(path: str, first: int = 0, last: int | None = None) -> list[Document]:
+    """Pages [first, last) of a PDF, one Document each, with the metadata PyMuPDFLoader gives them."""
+    with fitz.open(path) as pdf:
+        info = {key: value for key, value in pdf.metadata.items() if isinstance(value, (str, int))}
+        last = len(pdf) if last is None else min(last, len(pdf))
+        return [
+            Document(
+                page_content=pdf[number].get_text(),
+                metadata={"source": path, "file_path": path, "page": number, "total_pages": len(pdf), **info},
+            )
+            for number in range(first, last)
+        ]
+
+
+def load_pdf_chunks(
+    path: str,
+    splitter: RecursiveCharacterTextSplitter | None = None,
+    first: int = 0,
+    last: int | None = None,
+):
+    """Parse one PDF, or the pages [first, last) of it, and split it into chunks."""
+    splitter = splitter or make_text_splitter()
+    return splitter.split_documents(load_pdf_pages(path, first, last))
+
+
+def _settings_fingerprint() -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
+
+
+def load_manifest(path: Path = MANIFEST_PATH) -> dict:
+    """
+    Return the stored manifest, or an empty stale one if missing, unreadable or
+    built with other settings: the collection may then hold chunks no manifest
+    tracks (e.g. stored under random ids before manifests existed).
+    """
+    empty = {"settings": _settings_fingerprint(), "files": {}, "stale": True}
+    if not path.exists():
+        return empty
+    try:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return empty
+    if manifest.get("settings") != _settings_fingerprint():
+        # Different model or chunking: every stored vector is stale
+        manifest["files"] = {}
+        manifest["stale"] = True
+    return manifest
+
+
+def save_manifest(manifest: dict, path: Path = MANIFEST_PATH) -> None:
+    """Write the manifest atomically so a crash never leaves a half-written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = {"settings": _settings_fingerprint(), "files": manifest["files"]}
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _file_unchanged(path: str, entry: dict | None) -> bool:
+    """
+    Cheap size/mtime check first; only hash when those moved. A file that was
+    only touched gets its new size/mtime written into `entry`, so the next run
+    takes the cheap path again.
+    """
+    if entry is None:
+        return False
+    stat = os.stat(path)
+    if stat.st_size == entry.get("size") and stat.st_mtime == entry.get("mtime"):
+        return True
+    if file_sha256(path) != entry.get("sha256"):
+        return False
+    entry.update(size=stat.st_size, mtime=stat.st_mtime)
+    return True
+
+
+def _file_fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {"sha256": file_sha256(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _page_ranges(path: str, workers: int) -> list[tuple[int, int]]:
+    """Split a PDF into about `workers` page ranges of at least MIN_PAGES_PER_TASK pages."""
+    with fitz.open(path) as pdf:
+        pages = len(pdf)
+    size = max(MIN_PAGES_PER_TASK, math.ceil(pages / workers))
+    return [(first, first + size) for first in range(0, pages, size)] or [(0, 0)]
+
+
+def _parse_pdfs(paths: list[str], workers: int):
+    """
+    Yield (path, chunks, fingerprint) as each PDF finishes parsing. Large PDFs
+    are split into page ranges, so even a single book keeps every worker busy.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield path, load_pdf_chunks(path), _file_fingerprint(path)
+        return
+    ranges = {path: _page_ranges(path, workers) for path in paths}
+    parts: dict[str, dict[int, list]] = {path: {} for path in paths}
+    with ProcessPoolExecutor(max_workers=min(workers, sum(map(len, ranges.values())))) as pool:
+        futures = {
+            pool.submit(load_pdf_chunks, path, None, first, last): (path, first)
+            for path, path_ranges in ranges.items()
+            for first, last in path_ranges
+        }
+        for future in as_completed(futures):
+            path, first = futures[future]
+            parts[path][first] = future.result()
+            if len(parts[path]) == len(ranges[path]):
+                # Back in page order, as if the whole file had been parsed at once
+                done = parts.pop(path)
+                chunks = [chunk for start in sorted(done) for chunk in done[start]]
+                yield path, chunks, _file_fingerprint(path)
+
+
+class _BatchWriter:
+    """
+    Buffers chunks and embeds them in fixed-size batches.
+    Each embedded batch is written to Chroma on a background thread
+    while the next batch is being embedded.
+    """
+
+    def __init__(self, vectorstore, batch_size: int):
+        self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embeddings
+        self.batch_size = batch_size
+        self.ids: list[str] = []
+        self.docs: list = []
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def add(self, ids: list[str], docs: list) -> None:
+        self.ids.extend(ids)
+        self.docs.extend(docs)
+        while len(self.ids) >= self.batch_size:
+            self._write(self.ids[:self.batch_size], self.docs[:self.batch_size])
+            self.ids = self.ids[self.batch_size:]
+            self.docs = self.docs[self.batch_size:]
+
+    def _write(self, ids: list[str], docs: list) -> None:
+        vectors = self.embeddings.embed_documents([d.page_content for d in docs])
+        self._wait()
+        # Bulk upsert with precomputed vectors (the public add_texts API would re-embed)
+        self._pending = self._pool.submit(
+            self.vectorstore._collection.upsert,
+            ids=ids,
+            embeddings=vectors,
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata for d in docs],
+        )
+
+    def _wait(self) -> None:
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def close(self) -> None:
+        if self.ids:
+            self._write(self.ids, self.docs)
+            self.ids, self.docs = [], []
+        self._wait()
+        self._pool.shutdown()
+
+
+def sync_index(
+    vectorstore,
+    pdf_paths: list[str],
+    manifest_path: Path = MANIFEST_PATH,
+    workers: int = 1,
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> dict:
+    """
+    Bring the vector store in line with `pdf_paths`:
+      - unchanged PDFs are skipped without parsing
+      - changed PDFs only have their new chunks embedded; vanished chunks are deleted
+      - PDFs no longer listed are purged
+    Changed PDFs are parsed in `workers` processes, large ones split into page ranges, and embedded
+    `batch_size` chunks at a time.
+    The BM25 index is rebuilt from the collection afterwards if anything changed.
+    Returns counts of what was done.
+    """
+    manifest = load_manifest(manifest_path)
+    files: dict = manifest["files"]
+    stats = {"skipped": 0, "updated": 0, "purged": 0, "missing": 0, "added_chunks": 0, "deleted_chunks": 0}
+
+    # Listed PDFs that are not on disk are left as they are in the collection
+    missing = [p for p in pdf_paths if not os.path.isfile(p)]
+    if missing:
+        logger.warning("Skipping missing PDFs: %s", ", ".join(missing))
+        pdf_paths = [p for p in pdf_paths if p not in missing]
+        stats["missing"] = len(missing)
+
+    if manifest.pop("stale", False):
+        # No usable manifest: drop everything previously stored in the collection
+        existing = vectorstore.get(include=[])["ids"]
+        if existing:
+            vectorstore.delete(ids=existing)
+            stats["deleted_chunks"] += len(existing)
+
+    # 1. Purge PDFs that are no longer part of the corpus
+    for path in [p for p in files if p not in pdf_paths and p not in missing]:
+        old_ids = files.pop(path)["chunks"]
+        if old_ids:
+            vectorstore.delete(ids=old_ids)
+        stats["purged"] += 1
+        stats["deleted_chunks"] += len(old_ids)
+
+    changed = [p for p in pdf_paths if not _file_unchanged(p, files.get(p))]
+    stats["skipped"] = len(pdf_paths) - len(changed)
+
+    # 2. Re-split changed PDFs in parallel and diff chunk ids against the manifest
+    writer = _BatchWriter(vectorstore, batch_size)
+    try:
+        for path, chunks, fingerprint in _parse_pdfs(changed, workers):
+            ids = chunk_ids(chunks)
+            entry = files.get(path)
+            old_ids = set(entry["chunks"]) if entry else set()
+
+            dirty = [(i, c) for i, c in zip(ids, chunks) if i not in old_ids]
+            writer.add([i for i, _ in dirty], [c for _, c in dirty])
+            removed = list(old_ids - set(ids))
+            if removed:
+                vectorstore.delete(ids=removed)
+
+            files[path] = {**fingerprint, "chunks": ids}
+            stats["updated"] += 1
+            stats["added_chunks"] += len(dirty)
+            stats["deleted_chunks"] += len(removed)
+    finally:
+        writer.close()
+
+    # Upserts are idempotent, so an interrupted run simply redoes its files next time
+    save_manifest(manifest, manifest_path)
+
+    # 3. Rebuild the BM25 index from the same chunks whenever the collection changed
+    changed = stats["added_chunks"] or stats["deleted_chunks"]
+    if changed or not LEXICAL_INDEX_PATH.exists():
+        BM25Index.from_vectorstore(vectorstore).save(LEXICAL_INDEX_PATH)
+    # Likewise the quantized copy, whenever it is in use or already exists
+    if VECTOR_BACKEND == "quantized" or QuantizedVectorStore.exists(QUANTIZED_INDEX_DIR):
+        sync_quantized_index(vectorstore)
+    return stats
+
+
+def collection_fingerprint(vectorstore) -> str:
+    """Changes whenever the set of chunks, or the settings their vectors were computed with, changes."""
+    # Chunk ids are hashes of the chunk text, so equal id sets mean equal chunks
+    digest = hashlib.sha256(json.dumps(_settings_fingerprint(), sort_keys=True).encode("utf-8"))
+    for chunk_id in sorted(vectorstore.get(include=[])["ids"]):
+        digest.update(chunk_id.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def sync_quantized_index(vectorstore) -> bool:
+    """Rebuild the quantized index if it is missing or was built from other chunks; True if it was rebuilt."""
+    return QuantizedVectorStore.ensure(vectorstore, QUANTIZED_INDEX_DIR, collection_fingerprint(vectorstore))
+
+
+def open_vectorstore(embeddings=None):
+    """Open the persisted collection without ingesting anything."""
+    embeddings = embeddings or SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL)
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=PERSIST_DIRECTORY
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest PDFs into the Chroma collection used by the API server.")
+    parser.add_argument("pdfs", nargs="*", default=PDF_PATHS, help=f"PDF files (default: {' '.join(PDF_PATHS)})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF parsing processes")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks embedded per batch")
+    args = parser.parse_args(argv)
+    missing = [p for p in args.pdfs if not os.path.isfile(p)]
+    if missing:
+        parser.error(f"PDF not found: {', '.join(missing)}")
+
+    start = time.perf_counter()
+    vectorstore = open_vectorstore()
+    stats = sync_index(vectorstore, args.pdfs, workers=args.workers, batch_size=args.batch_size)
+    print(f"Ingestion finished in {time.perf_counter() - start:.1f}s: {stats}")
+
+
+if __name__ == "__main__":
+    main()
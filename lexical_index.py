@@ -0,0 +1,168 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from observability import span
+
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i if in into is it its me my of on or our "
+    "should so than that the their them then there these they this to was we what when where which who "
+    "why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def matches(metadata: dict, where: dict | None) -> bool:
+    return not where or all(metadata.get(key) == value for key, value in where.items())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the same chunks that are stored in Chroma, keyed by chunk id.
+    Built during ingestion and persisted as JSON next to the vector store.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict],
+        postings: dict[str, list[list[int]]],
+        doc_len: list[int],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        # term -> [[chunk index, term frequency], ...]
+        self.postings = postings
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.avg_len = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+
+    @classmethod
+    def build(cls, ids: list[str], texts: list[str], metadatas: list[dict]) -> "BM25Index":
+        postings: dict[str, list[list[int]]] = defaultdict(list)
+        doc_len = []
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append([doc, tf])
+        return cls(ids, texts, metadatas, dict(postings), doc_len)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "BM25Index":
+        data = vectorstore.get(include=["documents", "metadatas"])
+        return cls.build(data["ids"], data["documents"], [m or {} for m in data["metadatas"]])
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "postings": self.postings,
+            "doc_len": self.doc_len,
+        }), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(data["ids"], data["texts"], data["metadatas"], data["postings"], data["doc_len"])
+
+    def search(self, query: str, k: int, where: dict | None = None) -> list[tuple[Document, float]]:
+        n = len(self.ids)
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc] / (self.avg_len or 1))
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc, score in ranked:
+            if not matches(self.metadatas[doc], where):
+                continue
+            results.append((Document(page_content=self.texts[doc], metadata=self.metadatas[doc], id=self.ids[doc]), score))
+            if len(results) == k:
+                break
+        return results
+
+
+def chroma_where(where: dict | None) -> dict | None:
+    """Translate {"source": ..., "page": ...} equality filters into Chroma's where syntax."""
+    if not where:
+        return None
+    if len(where) == 1:
+        return dict(where)
+    return {"$and": [{key: {"$eq": value}} for key, value in where.items()]}
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combines Chroma vector search with the BM25 index by reciprocal-rank fusion.
+
+    Each side fetches `fetch_k` candidates. Every chunk scores
+    sum(1 / (rrf_k + rank)) over the lists it appears in, and the top `k`
+    are returned. `where` restricts both sides to chunks whose metadata
+    matches, e.g. {"source": "data/book_2.pdf", "page": 12}.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    where: dict | None = None
+
+    def with_filter(self, where: dict | None) -> "HybridRetriever":
+        return self.model_copy(update={"where": where}) if where else self
+
+    def search_with_scores(self, query: str) -> list[tuple[Document, float]]:
+        """Fused top-k documents, each paired with its vector relevance (0 if found only lexically)."""
+        # The vector search span includes embedding the query
+        with span("vector_search"):
+            vector_hits = self.vectorstore.similarity_search_with_relevance_scores(
+                query, k=self.fetch_k, filter=chroma_where(self.where)
+            )
+        with span("lexical_search"):
+            lexical_hits = self.lexical.search(query, self.fetch_k, self.where) if self.lexical else []
+
+        fused: dict[str, float] = defaultdict(float)
+        docs: dict[str, Document] = {}
+        relevance: dict[str, float] = {}
+        for hits, is_vector in ((vector_hits, True), (lexical_hits, False)):
+            for rank, (doc, score) in enumerate(hits):
+                key = doc.id or doc.page_content
+                fused[key] += 1.0 / (self.rrf_k + rank + 1)
+                docs.setdefault(key, doc)
+                if is_vector:
+                    relevance[key] = score
+
+        top = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return [(docs[key], relevance.get(key, 0.0)) for key in top]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return [doc for doc, _ in self.search_with_scores(query)]
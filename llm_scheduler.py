@@ -0,0 +1,293 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from observability import LLM_CHUNKS, LLM_IN_FLIGHT, LLM_QUEUED, LLM_SECONDS
+
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_MAX_PER_SESSION = int(os.getenv("LLM_MAX_PER_SESSION", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Lower value is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+SPECULATIVE = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", SPECULATIVE: "speculative"}
+
+
+class LLMQueueFull(RuntimeError):
+    """Raised when a generation cannot be admitted: the queue is full or the wait timed out."""
+    status_code = 503
+
+
+class LLMSessionBusy(LLMQueueFull):
+    """Raised when one session already has too many generations queued or running."""
+    status_code = 429
+
+
+class _Waiter:
+    __slots__ = ("priority", "session_id", "notify", "enqueued", "granted", "abandoned")
+
+    def __init__(self, priority: int, session_id: str, notify: Callable[[], None]):
+        self.priority = priority
+        self.session_id = session_id
+        self.notify = notify
+        self.enqueued = time.perf_counter()
+        self.granted: float | None = None
+        self.abandoned = False
+
+
+class LLMScheduler:
+    """
+    Admission control in front of the local Ollama instance.
+
+    At most `max_in_flight` generations run at once; the rest wait in a
+    bounded queue ordered by priority (interactive, then background, then
+    speculative work). Within a priority, a session's request is ranked by
+    how many it already has queued or running, so one busy session cannot
+    crowd out the others. Requests are rejected when the queue is full,
+    when a session has `max_per_session` outstanding, or after waiting
+    `queue_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        max_queue: int = LLM_MAX_QUEUE,
+        max_per_session: int = LLM_MAX_PER_SESSION,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._queued = 0
+        self._in_flight = 0
+        self._per_session: dict[str, int] = defaultdict(int)
+        self.rejected = 0
+        self.timed_out = 0
+        # priority -> [admitted, total wait, max wait, completed, total generation time]
+        self._timings: dict[int, list[float]] = defaultdict(lambda: [0, 0.0, 0.0, 0, 0.0])
+
+    def _enqueue(self, priority: int, session_id: str, notify: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(priority, session_id, notify)
+        with self._lock:
+            outstanding = self._per_session[session_id]
+            if session_id and outstanding >= self.max_per_session:
+                self.rejected += 1
+                raise LLMSessionBusy(f"Session already has {outstanding} generations in progress")
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._grant(waiter)
+            elif self._queued >= self.max_queue:
+                self.rejected += 1
+                raise LLMQueueFull("LLM queue is full")
+            else:
+                heapq.heappush(self._heap, (priority, outstanding, next(self._seq), waiter))
+                self._queued += 1
+            self._per_session[session_id] += 1
+        return waiter
+
+    def _grant(self, waiter: _Waiter) -> None:
+        waiter.granted = time.perf_counter()
+        self._in_flight += 1
+        timing = self._timings[waiter.priority]
+        wait = waiter.granted - waiter.enqueued
+        timing[0] += 1
+        timing[1] += wait
+        timing[2] = max(timing[2], wait)
+        LLM_SECONDS.labels("queue", PRIORITY_NAMES[waiter.priority]).observe(wait)
+        waiter.notify()
+
+    def _dispatch(self) -> None:
+        while self._heap and self._in_flight < self.max_in_flight:
+            waiter = heapq.heappop(self._heap)[3]
+            if waiter.abandoned:
+                continue
+            self._queued -= 1
+            self._grant(waiter)
+
+    def _forget(self, session_id: str) -> None:
+        self._per_session[session_id] -= 1
+        if not self._per_session[session_id]:
+            del self._per_session[session_id]
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Give up waiting; False if the slot was granted in the meantime and must be released instead."""
+        with self._lock:
+            if waiter.granted is not None:
+                return False
+            waiter.abandoned = True
+            self._queued -= 1
+            self._forget(waiter.session_id)
+            return True
+
+    def _release(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._forget(waiter.session_id)
+            timing = self._timings[waiter.priority]
+            timing[3] += 1
+            timing[4] += time.perf_counter() - waiter.granted
+            self._dispatch()
+
+    def _timeout(self) -> LLMQueueFull:
+        with self._lock:
+            self.timed_out += 1
+        return LLMQueueFull(f"Timed out after {self.queue_timeout:.0f}s waiting for the LLM")
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, session_id: str = "") -> Iterator[None]:
+        """Blocking: hold one generation slot for the duration of the block."""
+        granted = threading.Event()
+        waiter = self._enqueue(priority, session_id, granted.set)
+        if not granted.wait(self.queue_timeout) and self._abandon(waiter):
+            raise self._timeout()
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = INTERACTIVE, session_id: str = "") -> AsyncIterator[None]:
+        """Async variant of `slot`; cancelling the waiting task leaves the queue."""
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        waiter = self._enqueue(priority, session_id, lambda: loop.call_soon_threadsafe(granted.set))
+        try:
+            await asyncio.wait_for(granted.wait(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise self._timeout()
+        except BaseException:
+            if not self._abandon(waiter):
+                self._release(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_priority = {}
+            for priority, (admitted, wait, max_wait, completed, generation) in self._timings.items():
+                by_priority[PRIORITY_NAMES[priority]] = {
+                    "admitted": int(admitted),
+                    "avg_queue_wait_s": round(wait / admitted, 3) if admitted else 0.0,
+                    "max_queue_wait_s": round(max_wait, 3),
+                    "completed": int(completed),
+                    "avg_generation_s": round(generation / completed, 3) if completed else 0.0,
+                }
+            return {
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "max_in_flight": self.max_in_flight,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "by_priority": by_priority,
+            }
+
+
+def llm_config(session_id: str = "", priority: int = INTERACTIVE) -> RunnableConfig:
+    """Run config that tells ScheduledLLM who a generation is for."""
+    return {"metadata": {"session_id": session_id, "llm_priority": priority}}
+
+
+class ScheduledLLM(Runnable):
+    """
+    Wraps a chat model or LLM so every call goes through the scheduler.
+    Priority and session are read from the run config's metadata (see `llm_config`),
+    which LangChain passes down through prompt | llm | parser chains.
+    """
+
+    def __init__(self, llm: Runnable, scheduler: LLMScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+
+    @property
+    def InputType(self) -> Any:
+        return self.llm.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.llm.OutputType
+
+    @staticmethod
+    def _ticket(config: RunnableConfig | None) -> tuple[int, str]:
+        metadata = (config or {}).get("metadata") or {}
+        return metadata.get("llm_priority", INTERACTIVE), metadata.get("session_id", "")
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        priority, session_id = self._ticket(config)
+        with self.scheduler.slot(priority, session_id):
+            start = time.perf_counter()
+            result = self.llm.invoke(input, config, **kwargs)
+        LLM_SECONDS.labels("complete", PRIORITY_NAMES[priority]).observe(time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        priority, session_id = self._ticket(config)
+        async with self.scheduler.aslot(priority, session_id):
+            start = time.perf_counter()
+            result = await self.llm.ainvoke(input, config, **kwargs)
+        LLM_SECONDS.labels("complete", PRIORITY_NAMES[priority]).observe(time.perf_counter() - start)
+        return result
+
+    def stream(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Iterator[Any]:
+        priority, session_id = self._ticket(config)
+        # The slot is held until the stream is exhausted or closed
+        with self.scheduler.slot(priority, session_id):
+            timer = _StreamTimer(priority)
+            for chunk in self.llm.stream(input, config, **kwargs):
+                timer.chunk()
+                yield chunk
+            timer.done()
+
+    async def astream(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> AsyncIterator[Any]:
+        priority, session_id = self._ticket(config)
+        async with self.scheduler.aslot(priority, session_id):
+            timer = _StreamTimer(priority)
+            async for chunk in self.llm.astream(input, config, **kwargs):
+                timer.chunk()
+                yield chunk
+            timer.done()
+
+
+class _StreamTimer:
+    """Splits a streamed generation into prefill (until the first chunk) and generation (the rest)."""
+
+    def __init__(self, priority: int):
+        self.priority = PRIORITY_NAMES[priority]
+        self.start = time.perf_counter()
+        self.first: float | None = None
+        self.chunks = 0
+
+    def chunk(self) -> None:
+        self.chunks += 1
+        if self.first is None:
+            self.first = time.perf_counter()
+            LLM_SECONDS.labels("prefill", self.priority).observe(self.first - self.start)
+
+    def done(self) -> None:
+        if self.first is not None:
+            LLM_SECONDS.labels("generation", self.priority).observe(time.perf_counter() - self.first)
+        LLM_CHUNKS.labels(self.priority).inc(self.chunks)
+
+
+# One scheduler per process, shared by every chain that talks to Ollama
+llm_scheduler = LLMScheduler()
+LLM_IN_FLIGHT.set_function(lambda: llm_scheduler._in_flight)
+LLM_QUEUED.set_function(lambda: llm_scheduler._queued)
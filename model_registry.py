@@ -0,0 +1,122 @@
+import asyncio
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+
+VOICE_ENABLED = os.getenv("VOICE_ENABLED", "1") == "1"
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+class _Component:
+    def __init__(self, loader: Callable[[], Any], warm_up: Callable[[Any], None] | None, lazy: bool, fork_safe: bool):
+        self.loader = loader
+        self.warm_up = warm_up
+        self.lazy = lazy
+        self.fork_safe = fork_safe
+        self.lock = threading.Lock()
+        self.instance: Any = None
+        self.loaded = False
+        self.warmed = False
+        self.load_seconds: float | None = None
+        self.warm_up_seconds: float | None = None
+        self.error: str | None = None
+
+
+class ModelRegistry:
+    """
+    Heavy components (models, indexes) are registered with a loader and built
+    on first use instead of at import time, each exactly once.
+
+      - eager components are loaded and warmed up with `warm_up(name)`, e.g.
+        in parallel from the FastAPI lifespan; lazy ones are only loaded when
+        a request first needs them
+      - a loader may `get` other components, which are loaded first
+      - `preload()` loads the fork-safe components in the parent process
+        (gunicorn --preload), so forked workers share their read-only
+        weights copy-on-write instead of loading a copy each; warm-up is
+        left to each worker
+
+    Load and warm-up times are kept per component.
+    """
+
+    def __init__(self):
+        self._components: dict[str, _Component] = {}
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        warm_up: Callable[[Any], None] | None = None,
+        lazy: bool = False,
+        fork_safe: bool = False,
+    ) -> None:
+        self._components[name] = _Component(loader, warm_up, lazy, fork_safe)
+
+    def eager(self) -> list[str]:
+        return [name for name, c in self._components.items() if not c.lazy]
+
+    def loaded(self, name: str) -> bool:
+        return self._components[name].loaded
+
+    def get(self, name: str) -> Any:
+        """Blocking: the component, loading it first if needed."""
+        component = self._components[name]
+        if component.loaded:
+            return component.instance
+        with component.lock:
+            if not component.loaded:
+                start = time.perf_counter()
+                try:
+                    component.instance = component.loader()
+                except Exception as e:
+                    component.error = str(e)
+                    raise
+                component.load_seconds = time.perf_counter() - start
+                component.error = None
+                component.loaded = True
+                logger.info("Loaded %s in %.2fs", name, component.load_seconds)
+        return component.instance
+
+    async def aget(self, name: str) -> Any:
+        """`get` for async code: a lazy load runs off the event loop."""
+        component = self._components[name]
+        if component.loaded:
+            return component.instance
+        return await asyncio.to_thread(self.get, name)
+
+    def warm_up(self, name: str) -> Any:
+        """Blocking: load the component and run its warm-up once."""
+        instance = self.get(name)
+        component = self._components[name]
+        with component.lock:
+            if not component.warmed and component.warm_up is not None:
+                start = time.perf_counter()
+                component.warm_up(instance)
+                component.warm_up_seconds = time.perf_counter() - start
+            component.warmed = True
+        return instance
+
+    def preload(self) -> None:
+        for name, component in self._components.items():
+            if component.fork_safe and not component.lazy:
+                self.get(name)
+        # Keep the garbage collector from touching (and so copying) the preloaded objects' pages in workers
+        gc.freeze()
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "loaded": c.loaded,
+                "lazy": c.lazy,
+                "load_seconds": round(c.load_seconds, 3) if c.load_seconds is not None else None,
+                "warm_up_seconds": round(c.warm_up_seconds, 3) if c.warm_up_seconds is not None else None,
+                **({"error": c.error} if c.error else {}),
+            }
+            for name, c in self._components.items()
+        }
@@ -1,77 +1,147 @@
-from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException, Body
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, WebSocket, File, Form, UploadFile, BackgroundTasks, HTTPException, Body
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from datetime import datetime
 from pathlib import Path
 import whisper
+import logging
 import re
 import os
-import pyttsx3  # for male voice TTS
 import time
+import asyncio
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
 from langchain_ollama import ChatOllama
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.output_parsers import StrOutputParser
 import torch
+from audio_delivery import audio_encoder, audio_url, serve_audio
+from audio_io import decode_audio_bytes
+from ingest import (
+    EMBEDDING_MODEL, LEXICAL_INDEX_PATH, PDF_PATHS, PERSIST_DIRECTORY, QUANTIZED_INDEX_DIR, VECTOR_BACKEND,
+    open_vectorstore, sync_index, sync_quantized_index,
+)
+from lexical_index import BM25Index, HybridRetriever
+from prefetch import PREFETCH_ENABLED, PREFETCH_TTS, SuggestionPrefetcher
+from quantized_store import QuantizedVectorStore
+from query_embeddings import CachedEmbeddings
+from query_rewrite import QueryRewriter, needs_rewrite
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache
+from context_packing import ContextPacker, stored_embeddings
+from health import Readiness, warm
+from history_compaction import HistoryCompactor
+from model_registry import PRELOAD_MODELS, VOICE_ENABLED, ModelRegistry
+from observability import configure_logging, instrument, span
+from llm_scheduler import INTERACTIVE, SPECULATIVE, LLMQueueFull, ScheduledLLM, llm_config, llm_scheduler
+from ollama_backend import OLLAMA_MODEL, ollama_backend
+from session_store import SessionStore, resolve_session_id
+from streaming import SUGGESTIONS_MARKER, SuggestionStream, ndjson
+from transcription import TranscriptionBatcher, stream_transcription
+from tts import SpeechPipeline, TTSQueueFull, audio_cache, tts_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(audio_cache.evict)
+    # Spawn the TTS workers and load and warm every eager model in parallel, before the first request
+    await asyncio.gather(
+        warm(readiness, "tts", tts_pool.start),
+        *(warm(readiness, name, partial(registry.warm_up, name)) for name in registry.eager()),
+    )
+    # Ollama may still be starting up; keep trying in the background rather than blocking startup
+    ollama_warm_up = asyncio.create_task(warm(
+        readiness, "ollama", lambda: ollama_backend.warm_up(warm_up_llm), ollama_backend.model_loaded, retry_every=10
+    ))
+    yield
+    ollama_warm_up.cancel()
+    if prefetcher is not None:
+        prefetcher.shutdown()
+    tts_pool.shutdown()
 
 
 # App initialization
-app = FastAPI()
+configure_logging()
+logger = logging.getLogger(__name__)
+app = FastAPI(lifespan=lifespan)
+# Trace ids, per-route request metrics and GET /metrics
+instrument(app)
+# Compressed speech at GET /audio/{name}
+serve_audio(app)
 
 # Ensure directories exist
-UPLOAD_AUDIO_DIR = Path("uploads/audio")
 RESPONSE_AUDIO_DIR = Path("responses/audio")
-for directory in (UPLOAD_AUDIO_DIR, RESPONSE_AUDIO_DIR, Path("chroma_db")):
+for directory in (RESPONSE_AUDIO_DIR, Path(PERSIST_DIRECTORY)):
     directory.mkdir(parents=True, exist_ok=True)
 
 # Device selection
 device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Using device: {device}")
+logger.info("Using device: %s", device)
 
 
 
-# Load Whisper model globally
-whisper_model = whisper.load_model("turbo")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "turbo")
 
-# PDF loading and splitting setup
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=20,
-    length_function=len
-)
+# Heavy models are loaded by the registry in the lifespan, not at import time
+registry = ModelRegistry()
 
-def load_pdfs(paths: list[str]):
-    docs = []
-    for p in paths:
-        loader = PyMuPDFLoader(file_path=p)
-        docs.extend(loader.load())
-    return docs
-
-# Load and split once at startup
-PDF_PATHS = ["data/book_1.pdf"]
-raw_docs = load_pdfs(PDF_PATHS)
-chunks = text_splitter.split_documents(raw_docs)
-print(f"Loaded and split {len(chunks)} document chunks.")
-
-# Embedding and vectorstore
-embeddings = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-vectorstore = Chroma.from_documents(
-    collection_name="my_collection",
-    documents=chunks,
-    embedding=embeddings,
-    persist_directory="./chroma_db"
-)
-retriever = vectorstore.as_retriever(k=3)
+
+def load_whisper() -> TranscriptionBatcher:
+    # Concurrent uploads are transcribed together in micro-batches
+    return TranscriptionBatcher(whisper.load_model(WHISPER_MODEL), fp16=device == "cuda")
+
+
+def load_embeddings() -> CachedEmbeddings:
+    # Query vectors are cached and batched; document embedding passes straight through
+    return CachedEmbeddings(SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL))
+
+
+def load_retriever() -> HybridRetriever:
+    # Open the collection built by `python ingest.py`
+    vectorstore = open_vectorstore(registry.get("embeddings"))
+    if os.getenv("INGEST_ON_STARTUP", "0") == "1":
+        # Optional in-process sync for single-box setups; unchanged PDFs are skipped
+        logger.info("Ingestion: %s", sync_index(vectorstore, PDF_PATHS))
+
+    # Hybrid retrieval: BM25 catches exact terms and names that embeddings miss, fused by rank with vector search
+    if LEXICAL_INDEX_PATH.exists():
+        lexical_index = BM25Index.load(LEXICAL_INDEX_PATH)
+    else:
+        # Collections ingested before the BM25 index existed
+        lexical_index = BM25Index.from_vectorstore(vectorstore)
+        lexical_index.save(LEXICAL_INDEX_PATH)
+
+    if VECTOR_BACKEND == "quantized":
+        # int8 first pass over a memory-mapped index shared by all workers, float rescoring of the best candidates
+        # Missing, or left behind by an ingest run without VECTOR_BACKEND=quantized; one worker rebuilds it
+        sync_quantized_index(vectorstore)
+        quantized = QuantizedVectorStore.load(QUANTIZED_INDEX_DIR, registry.get("embeddings"))
+        logger.info("Quantized vector index: %s", quantized.stats())
+        vectorstore = quantized
+    return HybridRetriever(vectorstore=vectorstore, lexical=lexical_index, k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K)
+
+
+# Whisper is only loaded on first use when voice input is disabled
+registry.register("whisper", load_whisper, TranscriptionBatcher.warm_up, lazy=not VOICE_ENABLED, fork_safe=True)
+registry.register("embeddings", load_embeddings, CachedEmbeddings.warm_up, fork_safe=True)
+# Not fork-safe: Chroma holds an open SQLite connection
+registry.register("retriever", load_retriever)
 
 # LLM and RAG chain setup
-llm = ChatOllama(model="llama3.2:3B", temperature=0,device=device)
+# Pinned in memory through keep_alive and sharing the backend's pooled HTTP client
+chat_model = ollama_backend.attach(ChatOllama(
+    model=OLLAMA_MODEL,
+    base_url=ollama_backend.base_url,
+    keep_alive=ollama_backend.keep_alive,
+    temperature=0,
+    device=device
+))
+# Every generation goes through the shared scheduler, which bounds concurrent requests to Ollama
+llm = ScheduledLLM(chat_model, llm_scheduler)
 
 contextualize_q_system_prompt = """Given a chat history and the latest user question \
 which might reference context in the chat history, formulate a standalone question \
@@ -84,9 +154,9 @@ context_prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder("chat_history"),
     ("human", "{input}"),
 ])
-history_aware_retriever = create_history_aware_retriever(
-    llm, retriever, context_prompt
-)
+# Rewrites follow-up questions into standalone ones before retrieval, skipped when it cannot help
+rewrite_chain = context_prompt | llm | StrOutputParser()
+query_rewriter = QueryRewriter(rewrite_chain, lambda q: registry.get("retriever").search_with_scores(q))
 
 mentor_prompt_text = """
 ## System Prompt
@@ -173,48 +243,152 @@ qa_prompt = ChatPromptTemplate.from_messages([
 ])
 question_chain = create_stuff_documents_chain(llm, qa_prompt)
 
-# Build RAG chain
-rag = create_retrieval_chain(history_aware_retriever, question_chain)
 
-# Session history management
-store: dict[str, BaseChatMessageHistory] = {}
+def chunk_embeddings(docs):
+    return stored_embeddings(registry.get("retriever").vectorstore, registry.get("embeddings"))(docs)
+
+
+# Dedupes, merges and trims retrieved chunks to a token budget before they are stuffed into {context}
+context_packer = ContextPacker(chunk_embeddings)
+
+# Session history management (SQLite-backed, bounded in memory)
+session_store = SessionStore()
+compactor = HistoryCompactor(llm)
 
 def get_history(sid: str) -> BaseChatMessageHistory:
-    if sid not in store:
-        store[sid] = ChatMessageHistory()
-    return store[sid]
-
-conversation = RunnableWithMessageHistory(
-    rag,
-    get_history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-    output_messages_key="answer",
-)
+    return session_store.get(sid)
+
+# Optional cache of answers for semantically equivalent standalone questions
+semantic_cache = SemanticCache(lambda q: registry.get("embeddings").embed_query(q)) if SEMANTIC_CACHE_ENABLED else None
+
+# Optional speculative answers for the suggested follow-ups of each turn
+# (the lambda defers the lookup: prefetch_answer is defined further down)
+prefetcher = SuggestionPrefetcher(lambda *args: prefetch_answer(*args)) if PREFETCH_ENABLED else None
 
 TMP_AUDIO_DIR = Path("static/audio")
 TMP_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+
+readiness = Readiness(registry.eager() + ["ollama", "tts"])
+
+if PRELOAD_MODELS and device == "cpu":
+    # Under `gunicorn --preload`, forked workers share these weights instead of loading their own
+    registry.preload()
+
+
+def warm_up_llm():
+    # A one-token answer through the real QA prompt, so Ollama caches the system prompt prefix
+    (qa_prompt | chat_model.bind(options={"num_predict": 1})).invoke(
+        {"input": "Hello", "chat_history": [], "context": ""}
+    )
+
+
+@app.exception_handler(TTSQueueFull)
+async def tts_queue_full_handler(request, exc: TTSQueueFull):
+    return JSONResponse(status_code=503, content={"error": str(exc)})
+
+
+@app.exception_handler(LLMQueueFull)
+async def llm_queue_full_handler(request, exc: LLMQueueFull):
+    return JSONResponse(status_code=exc.status_code, content={"error": str(exc)})
+
+
+@app.get("/health")
+async def health():
+    """Readiness: 200 once every model is loaded and warm, 503 until then."""
+    ready, components = await asyncio.to_thread(readiness.status)
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": components})
+
+
+@app.get("/models")
+async def models():
+    """Load and warm-up time of each heavy component; lazy ones show as not loaded until first use."""
+    return JSONResponse(registry.stats())
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """In-flight and queued generations, rejections, and queue wait vs. generation time per priority."""
+    return JSONResponse(llm_scheduler.stats())
+
+
+@app.get("/tts/stats")
+async def tts_stats():
+    """Queue depth and synthesis timings of the TTS worker pool, audio cache hit rate and encoding."""
+    return JSONResponse({**tts_pool.stats(), "cache": audio_cache.stats(), "encoding": audio_encoder.stats()})
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate of the semantic answer cache."""
+    if semantic_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **semantic_cache.stats()})
+
+
+@app.get("/rewrite/stats")
+async def rewrite_stats():
+    """How often the history-aware question rewrite was skipped or run."""
+    return JSONResponse(query_rewriter.stats())
+
+
+@app.get("/embeddings/stats")
+async def embeddings_stats():
+    """Hit rate and batching of the query-embedding cache."""
+    return JSONResponse((await registry.aget("embeddings")).stats())
+
+
+@app.get("/prefetch/stats")
+async def prefetch_stats():
+    """How often a suggested follow-up was served from a speculative answer."""
+    if prefetcher is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **prefetcher.stats()})
+
+
+@app.get("/context/stats")
+async def context_stats():
+    """Prompt tokens saved by context packing."""
+    return JSONResponse(context_packer.stats())
+
+
+@app.get("/whisper/stats")
+async def whisper_stats():
+    """Micro-batching counters of the transcription scheduler."""
+    if not registry.loaded("whisper"):
+        return JSONResponse({"loaded": False})
+    return JSONResponse(registry.get("whisper").stats())
+
 @app.post("/whisper")
 async def whisper_endpoint(file: UploadFile = File(...)):
-    filename = UPLOAD_AUDIO_DIR / file.filename
+    data = await file.read()
+    with span("decode"):
+        try:
+            # Decoded straight from the request bytes; nothing touches the disk
+            audio = await asyncio.to_thread(decode_audio_bytes, data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        with open(filename, "wb") as f:
-            f.write(await file.read())
-        result = whisper_model.transcribe(str(filename))
-        text = result.get("text", "")
-        print(f"Transcription: {text}")
-        os.remove(filename)
+        transcriber = await registry.aget("whisper")
+        with span("stt"):
+            text = await transcriber.transcribe(audio)
+        logger.debug("Transcription: %s", text)
         # Return transcription result and detected language
         return JSONResponse(content={
             "transcription": text
         })
     except Exception as e:
-        print(f"Error during audio transcription: {e}")
+        logger.exception("Audio transcription failed")
         raise HTTPException(status_code=500, detail=f"Failed to transcribe audio: {e}")
 
 
+@app.websocket("/whisper/stream")
+async def whisper_stream_endpoint(websocket: WebSocket):
+    """Incremental transcription: speech segments are transcribed while the user is still talking."""
+    await stream_transcription(websocket, await registry.aget("whisper"))
+
+
 def parse_response_and_suggestions(raw: str) -> tuple[str, list[str]]:
     """
     Splits the raw response into:
@@ -240,111 +414,342 @@ def parse_response_and_suggestions(raw: str) -> tuple[str, list[str]]:
 @app.post("/ask")
 async def ask(query: dict = Body(...), background_tasks: BackgroundTasks = None):
     try:
-        print(f"Received query: {query}")
         q = query.get("query")
         if not q:
             raise JSONResponse(status_code=400, content={"error": "Query text is missing"})
         
-        session_id = "default_session" 
+        session_id = resolve_session_id(query.get("session_id"))
+        where = parse_filter(query.get("filter"))
 
         message = f"Query: {q}"
-        
-        print(message)
+        logger.info("Question for session %s (%d chars)", session_id, len(q))
 
-        # Prepare chat input
+        # Prepare chat input; TTS runs sentence by sentence while the answer streams in
         input_message = message
-        response = generate_response(input_message,session_id)
-        response = response.replace("Interactive Engagement Question:","" ).replace("\n", "")
-        print(f"Response from conversational_rag_chain: {response}")
-
-        print(f"Generated response: {response}")
-
-        # 2. Parse out the pure response vs. suggestions
-        main_resp, suggestions = parse_response_and_suggestions(response)
-        
-        print(f"Main response: {main_resp}")
-        print(f"Suggestions: {suggestions}")
-
-        # Generate audio response
-        audio_path= generate_audio_from_response(main_resp)
-        print("Audio response generated.")
-        print(store)
-        
-       
-        audio_url = f"http://10.7.0.28:5505/static/audio/{audio_path.name}"
-        return JSONResponse(
-            content={
-                "response": main_resp,
-                "suggestions": suggestions,
-                "audio_url": f"http://10.7.0.28:5505/static/audio/{audio_path.name}"
-            }
-        )
+        turn = await prepare_turn(input_message, session_id, where)
+        return JSONResponse(content=await asyncio.to_thread(answer_turn, input_message, turn))
+    except TTSQueueFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except LLMQueueFull as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
-# TTS engine setup
-engine = pyttsx3.init()
-voices = engine.getProperty("voices")
-# Choose a male voice (first male found)
-for v in voices:
-    if "male" in v.name.lower() or "male" in v.id:
-        engine.setProperty("voice", v.id)
-        break
-
+@app.post("/ask/stream")
+async def ask_stream(query: dict = Body(...)):
+    """
+    Streaming variant of /ask. Emits newline-delimited JSON events:
+      {"type": "token", "text": ...}           as Ollama produces tokens
+      {"type": "suggestion", "text": ...}      as each follow-up prompt completes
+      {"type": "audio", "url": ...}            as each spoken sentence is synthesized
+      {"type": "done", "response": ..., "suggestions": [...], "audio_url": ..., "timings": {...}}
+    """
+    q = query.get("query")
+    if not q:
+        return JSONResponse(status_code=400, content={"error": "Query text is missing"})
+    session_id = resolve_session_id(query.get("session_id"))
+    try:
+        where = parse_filter(query.get("filter"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    message = f"Query: {q}"
+    logger.info("Streamed question for session %s (%d chars)", session_id, len(q))
+    turn = await prepare_turn(message, session_id, where)
+
+    # Sync generator: Starlette iterates it in the threadpool, off the event loop
+    return StreamingResponse(ndjson(answer_events(message, turn)), media_type="application/x-ndjson")
+
+
+async def transcribe_upload(file: UploadFile, timings: dict) -> str:
+    """Decode and transcribe an uploaded recording in memory, recording both stages in `timings`."""
+    data = await file.read()
+    with span("decode", timings):
+        try:
+            audio = await asyncio.to_thread(decode_audio_bytes, data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    with span("stt", timings):
+        transcriber = await registry.aget("whisper")
+        text = (await transcriber.transcribe(audio)).strip()
+    logger.debug("Transcription: %s", text)
+    if not text:
+        raise HTTPException(status_code=400, detail="No speech detected")
+    return text
+
+
+async def prepare_voice_turn(file: UploadFile, session_id: str | None) -> tuple[str, str, dict]:
+    started = time.perf_counter()
+    timings = {}
+    text = await transcribe_upload(file, timings)
+    message = f"Query: {text}"
+    turn = await prepare_turn(message, resolve_session_id(session_id))
+    # Stage timings and the total count from the moment the upload arrived
+    turn["started"] = started
+    turn["timings"] = {**timings, **turn["timings"]}
+    return text, message, turn
+
+
+@app.post("/voice-ask")
+async def voice_ask(file: UploadFile = File(...), session_id: str | None = Form(None)):
+    """
+    Voice in, voice out in one request: the recording is transcribed in memory and answered
+    straight away. Returns the /ask fields plus the transcription and per-stage timings in seconds.
+    """
+    text, message, turn = await prepare_voice_turn(file, session_id)
+    body = await asyncio.to_thread(answer_turn, message, turn)
+    return JSONResponse({"transcription": text, **body})
+
+
+@app.post("/voice-ask/stream")
+async def voice_ask_stream(file: UploadFile = File(...), session_id: str | None = Form(None)):
+    """Streaming variant of /voice-ask: a {"type": "transcription"} event, then the /ask/stream events."""
+    text, message, turn = await prepare_voice_turn(file, session_id)
+
+    def events():
+        yield {"type": "transcription", "text": text}
+        yield from answer_events(message, turn)
+
+    return StreamingResponse(ndjson(events()), media_type="application/x-ndjson")
+
+
+def turn_timings(turn: dict) -> dict:
+    return {
+        **{stage: round(seconds, 3) for stage, seconds in turn["timings"].items()},
+        "total": round(time.perf_counter() - turn["started"], 3),
+    }
+
+
+def answer_turn(message: str, turn: dict) -> dict:
+    """Blocking: answer a prepared turn with speech, record it, and return the response body."""
+    speech = new_speech_pipeline()
+    raw_response = generate_response(message, turn, speech)
+
+    # Parse out the pure response vs. suggestions
+    with span("parse"):
+        main_resp, suggestions = parse_response_and_suggestions(clean_response(raw_response))
+    logger.debug("Suggestions: %s", suggestions)
+
+    # Wait for the remaining sentences and join them
+    with span("tts", turn["timings"]):
+        audio_path = speech.finish()
+    finish_turn(turn, message, raw_response)
+    schedule_prefetch(turn, suggestions)
+    return {
+        "response": main_resp,
+        "suggestions": suggestions,
+        "audio_url": audio_url(audio_path),
+        "session_id": turn["session_id"],
+        "timings": turn_timings(turn),
+    }
+
+
+def answer_events(message: str, turn: dict):
+    """Sync generator of the /ask/stream events for a prepared turn."""
+    stream = SuggestionStream(parse_response_and_suggestions, clean_response)
+    speech = new_speech_pipeline()
+    raw_response = ""
+    try:
+        for token in stream_response(message, turn):
+            raw_response += token
+            yield {"type": "token", "text": token}
+            for suggestion in stream.feed(token):
+                yield {"type": "suggestion", "text": suggestion}
+            speech.feed(token)
+            for segment in speech.ready_segments():
+                yield {"type": "audio", "url": audio_url(segment)}
+    except LLMQueueFull as e:
+        # Headers are already sent, so the rejection is reported in-band
+        yield {"type": "error", "status": e.status_code, "error": str(e)}
+        return
+
+    main_resp, suggestions, remaining = stream.close()
+    for suggestion in remaining:
+        yield {"type": "suggestion", "text": suggestion}
 
-def generate_response(query_text,session_id="default_session"):
-    """Generate a response based on the query."""
     try:
-        
-        # Ensure the session ID is passed correctly
-        response = conversation.invoke(
-            {'input': query_text},
-            config={'session_id': session_id}  # Correct the dictionary key
-        )["answer"]
-
-        # Normalize the response text
-        response_cleaned = response.replace("\n", "").replace("*", " ")
-        print(f"Generated response: {response_cleaned}")
-        return response_cleaned
+        with span("tts", turn["timings"]):
+            audio_path = speech.finish()
     except Exception as e:
-        print(f"Error in generate_response: {str(e)}")
-        return {"error": str(e)}
-
-# Initialize once at startup (global)
-# fastpitch = TTS(model_name="tts_models/en/ljspeech/fast_pitch")  # Fully-parallel TTS model with pitch prediction :contentReference[oaicite:1]{index=1}
-TMP_AUDIO_DIR = Path("static/audio")
-
-# def generate_audio_from_response(response_text: str) -> Path:
-#     """
-#     Synthesize response_text using FastPitch and save to a .wav file.
-#     Returns the Path to the generated audio.
-#     """
-#     timestamp = int(time.time() * 1000)
-#     out_path = TMP_AUDIO_DIR / f"response_{timestamp}.wav"
-
-#     # Run synthesis (this blocks until file is written)
-#     fastpitch.tts_to_file(text=response_text, file_path=str(out_path))
-#     return out_path
-
-engine = pyttsx3.init()
-voices = engine.getProperty("voices")
-for v in voices:
-    if "male" in v.name.lower() or "male" in v.id:
-        engine.setProperty("voice", v.id)
-        break
-
-def generate_audio_from_response(response_text: str) -> Path:
+        # The answer is complete, so the missing speech is reported in-band and "done" still follows
+        logger.warning("Speech synthesis failed: %s", e)
+        status = 503 if isinstance(e, TTSQueueFull) else 500
+        yield {"type": "error", "status": status, "error": f"Speech synthesis failed: {e}"}
+        audio_path = None
+    for segment in speech.ready_segments():
+        yield {"type": "audio", "url": audio_url(segment)}
+    finish_turn(turn, message, raw_response)
+    schedule_prefetch(turn, suggestions)
+    yield {
+        "type": "done",
+        "response": main_resp,
+        "suggestions": suggestions,
+        "audio_url": audio_url(audio_path),
+        "session_id": turn["session_id"],
+        "timings": turn_timings(turn),
+    }
+
+
+def clean_response(raw: str) -> str:
+    """Strip newlines, markdown and the engagement-question heading from the answer."""
+    return raw.replace("\n", "").replace("*", " ").replace("Interactive Engagement Question:", "")
+
+
+def parse_filter(value) -> dict | None:
+    """Optional metadata filter from the request body, e.g. {"source": "data/book_2.pdf", "page": 12}."""
+    if value is None:
+        return None
+    if not isinstance(value, dict) or not set(value) <= {"source", "page"}:
+        raise ValueError('filter must be an object with "source" and/or "page"')
+    return value or None
+
+
+async def prepare_turn(query_text: str, session_id: str, where: dict | None = None) -> dict:
     """
-    Synthesize `response_text` using pyttsx3 into an MP3
-    and return the Path to the saved file.
+    Everything needed before generation: the session history, the standalone
+    question used for retrieval (rewritten only when needed) and, when enabled,
+    a semantic cache lookup. `where` restricts retrieval to matching chunks.
     """
-    # choose filename
-    ts = int(time.time() * 1000)
-    out_path = TMP_AUDIO_DIR / f"response_{ts}.mp3"
-
-    # queue up the save
-    engine.save_to_file(response_text, str(out_path))
-    engine.runAndWait()    # perform synthesis & write file
+    started = time.perf_counter()
+    history = get_history(session_id)
+    turn_retriever = (await registry.aget("retriever")).with_filter(where)
+    if prefetcher is not None:
+        prefetched = await asyncio.to_thread(lambda: prefetcher.take(session_id, query_text, history.messages, where))
+        if prefetched is not None:
+            logger.info("Serving a prefetched answer")
+            return {
+                "session_id": session_id,
+                "history": history,
+                "chat_history": [],
+                "standalone": query_text,
+                "where": where,
+                "retriever": turn_retriever,
+                "docs": None,
+                "cached": {"answer": prefetched},
+                "vector": None,
+                "started": started,
+                "timings": {"retrieval": time.perf_counter() - started},
+            }
 
-    return out_path
+    # Recent turns verbatim plus a running summary of older ones, within a token budget
+    with span("history"):
+        chat_history = await asyncio.to_thread(lambda: compactor.compact(session_id, history.messages))
+    standalone, docs = await query_rewriter.standalone(
+        query_text, chat_history, turn_retriever.search_with_scores, config=llm_config(session_id)
+    )
+
+    cached, vector = None, None
+    # A follow-up used as is although it refers back (the rewrite lost the race to a close match) only
+    # makes sense with this session's history, so it must neither hit nor fill the shared cache
+    history_dependent = bool(chat_history) and standalone == query_text and needs_rewrite(query_text)
+    # Cached answers were grounded in the whole collection, so filtered questions bypass the cache
+    if semantic_cache is not None and where is None and not history_dependent:
+        with span("cache_lookup"):
+            cached, vector = await asyncio.to_thread(semantic_cache.lookup, standalone)
+        if cached is not None:
+            logger.info("Semantic cache hit")
+    return {
+        "session_id": session_id,
+        "history": history,
+        "chat_history": chat_history,
+        "standalone": standalone,
+        "where": where,
+        "retriever": turn_retriever,
+        "docs": docs,
+        "cached": cached,
+        "vector": vector,
+        "started": started,
+        # Seconds per stage; retrieval also covers history compaction and the question rewrite
+        "timings": {"retrieval": time.perf_counter() - started},
+    }
+
+
+def finish_turn(turn: dict, query_text: str, raw_response: str) -> None:
+    """Record the exchange in the session history and, on a cache miss, in the semantic cache."""
+    turn["history"].add_user_message(query_text)
+    turn["history"].add_ai_message(raw_response)
+    compactor.schedule_update(turn["session_id"], turn["history"].messages)
+    if semantic_cache is not None and turn["cached"] is None and turn["vector"] is not None:
+        semantic_cache.store(turn["vector"], turn["standalone"], {"answer": raw_response})
+
+
+def prefetch_answer(session_id: str, query_text: str, messages: list, where: dict | None, cancelled) -> str | None:
+    """Answer a suggested follow-up against a forked history; stops early once `cancelled` is set."""
+    chat_history = compactor.compact(session_id, messages)
+    config = llm_config(session_id, SPECULATIVE)
+    retriever = registry.get("retriever").with_filter(where)
+    # Sync rewrite: the shared Ollama AsyncClient must stay on the server's event loop
+    standalone, docs = query_rewriter.standalone_sync(
+        query_text, chat_history, retriever.search_with_scores, config=config
+    )
+    turn = {
+        "session_id": session_id,
+        "priority": SPECULATIVE,
+        "chat_history": chat_history,
+        "standalone": standalone,
+        "retriever": retriever,
+        "docs": docs,
+        "cached": None,
+    }
+    response = ""
+    # Closing the stream early stops Ollama from generating the rest
+    for token in stream_response(query_text, turn):
+        if cancelled.is_set():
+            return None
+        response += token
+    if PREFETCH_TTS and tts_pool.stats()["queue_depth"] == 0:
+        # Synthesized audio lands in the content-addressed cache, so serving the answer later reuses it
+        speech = new_speech_pipeline()
+        try:
+            speech.feed(response)
+            speech.finish()
+        except TTSQueueFull:
+            pass
+    return response
+
+
+def schedule_prefetch(turn: dict, suggestions: list[str]) -> None:
+    if prefetcher is not None and suggestions:
+        queries = [f"Query: {s}" for s in suggestions]
+        prefetcher.schedule(turn["session_id"], turn["history"].messages, queries, turn["where"])
+
+
+def generate_response(query_text, turn, speech=None):
+    """Generate the raw answer for a prepared turn, feeding tokens to `speech` as they arrive."""
+    response = ""
+    for token in stream_response(query_text, turn):
+        response += token
+        if speech is not None:
+            speech.feed(token)
+    logger.debug("Generated response: %s", response)
+    return response
+
+
+def stream_response(query_text, turn):
+    """Yield answer tokens; a semantic cache hit yields the stored answer at once."""
+    timings = turn.setdefault("timings", {})
+    if turn["cached"] is not None:
+        timings["llm"] = 0.0
+        yield turn["cached"]["answer"]
+        return
+    start = time.perf_counter()
+    docs = turn["docs"] if turn["docs"] is not None else turn["retriever"].invoke(turn["standalone"])
+    with span("context_packing"):
+        context = context_packer.pack(docs)
+    timings["retrieval"] = timings.get("retrieval", 0.0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    yield from question_chain.stream({
+        "input": query_text,
+        "chat_history": turn["chat_history"],
+        "context": context,
+    }, config=llm_config(turn["session_id"], turn.get("priority", INTERACTIVE)))
+    timings["llm"] = time.perf_counter() - start
+
+
+def new_speech_pipeline() -> SpeechPipeline:
+    """Sentence-level TTS for one answer; audio is cached by text in static/audio."""
+    return SpeechPipeline(clean_response, SUGGESTIONS_MARKER)
@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+TRACE_HEADER = "X-Request-ID"
+
+# Seconds; covers everything from a cache lookup to a long generation
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+REQUESTS = Counter("mentor_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram(
+    "mentor_http_request_seconds", "Time until the response headers are sent", ["method", "route"], buckets=BUCKETS
+)
+STAGE_SECONDS = Histogram("mentor_stage_seconds", "Time spent per pipeline stage", ["stage"], buckets=BUCKETS)
+LLM_SECONDS = Histogram(
+    "mentor_llm_seconds",
+    "LLM queue wait, prefill (time to first token), generation, and whole non-streamed calls",
+    ["phase", "priority"],
+    buckets=BUCKETS,
+)
+LLM_CHUNKS = Counter("mentor_llm_chunks_total", "Streamed LLM chunks (about one token each)", ["priority"])
+LLM_IN_FLIGHT = Gauge("mentor_llm_in_flight", "Generations running against Ollama")
+LLM_QUEUED = Gauge("mentor_llm_queued", "Generations waiting for a slot")
+TTS_QUEUE_DEPTH = Gauge("mentor_tts_queue_depth", "Sentences waiting for a TTS worker")
+
+# Set per request by the tracing middleware; asyncio tasks and to_thread calls inherit it
+trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+
+logger = logging.getLogger(__name__)
+
+
+class _TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id.get()
+        return True
+
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    """One stderr handler on the root logger whose lines carry the current request's trace id."""
+    root = logging.getLogger()
+    if any(isinstance(f, _TraceIdFilter) for h in root.handlers for f in h.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(_TraceIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+@contextmanager
+def span(stage: str, timings: dict | None = None) -> Iterator[None]:
+    """
+    Time a pipeline stage into the `mentor_stage_seconds` histogram and, when
+    given, add it to the request's `timings`. Stages that raise are not recorded.
+    """
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.labels(stage).observe(elapsed)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+    logger.debug("%s took %.1f ms", stage, elapsed * 1000)
+
+
+def instrument(app: FastAPI) -> None:
+    """
+    Give every request a trace id (the caller's X-Request-ID, or a new one),
+    returned in the response headers and attached to every log line written
+    while handling it; count requests per route; serve GET /metrics.
+    """
+
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        token = trace_id.set(request.headers.get(TRACE_HEADER) or uuid.uuid4().hex[:16])
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers[TRACE_HEADER] = trace_id.get()
+            return response
+        finally:
+            # Route templates, not raw paths, keep the label set small
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            REQUESTS.labels(request.method, route, str(status)).inc()
+            REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - start)
+            trace_id.reset(token)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus text format; with several workers each one reports only its own requests."""
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,77 @@
+import logging
+import os
+import time
+
+import httpx
+from ollama import AsyncClient, Client
+
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3B")
+# Negative keeps the model loaded indefinitely instead of Ollama's default 5 minutes
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+def _keep_alive(value: str) -> int | str:
+    # Ollama takes either seconds as a number or a duration string such as "30m"
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class OllamaBackend:
+    """
+    Owns the connection to the local Ollama server.
+
+    One pooled HTTP client (sync and async) is shared by every model built
+    with `attach`, so requests reuse keep-alive connections. Every request
+    carries `keep_alive`, which keeps the model resident between requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        model: str = OLLAMA_MODEL,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        timeout: float = OLLAMA_TIMEOUT,
+    ):
+        self.base_url = base_url
+        self.model = model
+        self.keep_alive = _keep_alive(keep_alive)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = Client(host=base_url, limits=limits, timeout=timeout)
+        # Its pooled connections belong to the loop that opened them: only await it on the server's event loop
+        self.async_client = AsyncClient(host=base_url, limits=limits, timeout=timeout)
+
+    def attach(self, model):
+        """Point a ChatOllama/OllamaLLM at the shared clients instead of the pair it created for itself."""
+        model._client = self.client
+        model._async_client = self.async_client
+        return model
+
+    def model_loaded(self) -> bool:
+        """Whether Ollama is reachable and has the model in memory."""
+        try:
+            running = self.client.ps()["models"]
+        except Exception:
+            return False
+        names = {(m.get("model") or m.get("name") or "").lower() for m in running}
+        return self.model.lower() in names
+
+    def warm_up(self, generate) -> float:
+        """Run `generate()` (a one-token generation) to load the model and prime its prompt cache; returns seconds."""
+        start = time.perf_counter()
+        generate()
+        elapsed = time.perf_counter() - start
+        logger.info("Ollama model %s warmed up in %.2fs", self.model, elapsed)
+        return elapsed
+
+
+# One backend per process, shared by every chain that talks to Ollama
+ollama_backend = OllamaBackend()
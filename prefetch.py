@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from langchain_core.messages import BaseMessage
+
+from text_utils import normalize_text
+
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_SUGGESTIONS", "0") == "1"
+PREFETCH_TTS = os.getenv("PREFETCH_TTS", "0") == "1"
+PREFETCH_MAX_SESSIONS = int(os.getenv("PREFETCH_MAX_SESSIONS", "256"))
+
+logger = logging.getLogger(__name__)
+
+
+def _key(text: str) -> str:
+    return normalize_text(text).lower()
+
+
+def _anchor(messages: list[BaseMessage]) -> str:
+    return f"{messages[-1].type}\0{messages[-1].content}" if messages else ""
+
+
+def _lower_priority() -> None:
+    # Linux lets a single thread be reniced through its native id
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class _Prefetch:
+    """Speculative answers for one session's suggestions, valid only while its history is unchanged."""
+
+    def __init__(self, anchor: str, where: dict | None):
+        self.anchor = anchor
+        self.where = where
+        # suggestion key -> (future answer, cancel flag)
+        self.jobs: dict[str, tuple[Future, threading.Event]] = {}
+
+    def cancel(self, keep: str | None = None) -> None:
+        for key, (future, cancelled) in self.jobs.items():
+            if key != keep:
+                cancelled.set()
+                future.cancel()
+
+
+class SuggestionPrefetcher:
+    """
+    Answers the bot's own follow-up suggestions in the background, so that
+    clicking one is served at once.
+
+    After a turn, `schedule` queues one job per suggestion on a single
+    low-priority worker thread. Each job calls `answer(session_id, query,
+    messages, where, cancelled)` against a copy of the session history as it
+    stands after that turn; the real history is never touched. `answer`
+    should return None once `cancelled` is set.
+
+    On the next turn `take` returns the answer if the user asked one of the
+    suggestions verbatim and the history has not moved on. A job that is
+    still running is waited for; one that has not started is dropped. All
+    other jobs for the session are cancelled.
+    """
+
+    def __init__(
+        self,
+        answer: Callable[[str, str, list[BaseMessage], dict | None, threading.Event], str | None],
+        max_sessions: int = PREFETCH_MAX_SESSIONS,
+    ):
+        self.answer = answer
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, _Prefetch] = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch", initializer=_lower_priority)
+        self.scheduled = 0
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self, session_id: str, messages: list[BaseMessage], suggestions: list[str], where: dict | None = None) -> None:
+        fork = list(messages)
+        prefetch = _Prefetch(_anchor(fork), where)
+        with self._lock:
+            previous = self._sessions.pop(session_id, None)
+            self._sessions[session_id] = prefetch
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+            for suggestion in suggestions:
+                key = _key(suggestion)
+                if key and key not in prefetch.jobs:
+                    cancelled = threading.Event()
+                    future = self._pool.submit(self._run, session_id, suggestion, fork, where, cancelled)
+                    prefetch.jobs[key] = (future, cancelled)
+            self.scheduled += len(prefetch.jobs)
+        for stale in ([previous] if previous else []) + evicted:
+            stale.cancel()
+
+    def _run(
+        self,
+        session_id: str,
+        suggestion: str,
+        messages: list[BaseMessage],
+        where: dict | None,
+        cancelled: threading.Event,
+    ) -> str | None:
+        if cancelled.is_set():
+            return None
+        try:
+            return self.answer(session_id, suggestion, messages, where, cancelled)
+        except Exception as e:
+            logger.warning("Prefetch failed for %r: %s", suggestion, e)
+            return None
+
+    def take(self, session_id: str, query: str, messages: list[BaseMessage], where: dict | None = None) -> str | None:
+        """Blocking: the prefetched answer for `query`, or None. Cancels the session's other jobs either way."""
+        with self._lock:
+            prefetch = self._sessions.pop(session_id, None)
+        if prefetch is None:
+            return None
+
+        key = _key(query)
+        job = prefetch.jobs.get(key)
+        usable = (
+            job is not None
+            and prefetch.anchor == _anchor(messages)
+            and prefetch.where == where
+            and (job[0].running() or job[0].done())
+        )
+        prefetch.cancel(keep=key if usable else None)
+        answer = job[0].result() if usable and not job[0].cancelled() else None
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            taken = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "scheduled": self.scheduled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / taken, 4) if taken else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for prefetch in sessions:
+            prefetch.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
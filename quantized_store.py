@@ -0,0 +1,386 @@
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from lexical_index import matches
+
+
+# Candidates rescored with float vectors per result requested
+QUANTIZED_RESCORE = int(os.getenv("QUANTIZED_RESCORE", "4"))
+# Rows scored per step of the int8 pass; bounds the float scratch space to BLOCK_ROWS x dim x 4 bytes (6 MB at 384 dims)
+BLOCK_ROWS = 4096
+BUILD_BATCH = 5000
+MAX_CACHED_FILTERS = 256
+
+_FILES = (
+    "codes.npy", "scales.npy", "vectors.npy", "ids.json", "texts.bin", "metadatas.bin", "offsets.npy", "meta.json",
+)
+
+
+@contextmanager
+def _locked(path: Path, name: str, exclusive: bool = True) -> Iterator[None]:
+    """flock on a file next to the index, shared between the worker processes of a server."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.parent / f"{path.name}.{name}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _flat_filter(where: dict | None) -> dict | None:
+    """Accept the Chroma where clauses HybridRetriever sends ({"k": v}, {"k": {"$eq": v}}, {"$and": [...]})."""
+    if not where:
+        return None
+    flat = {}
+    for clause in where["$and"] if set(where) == {"$and"} else [where]:
+        for key, value in clause.items():
+            if isinstance(value, dict):
+                if set(value) != {"$eq"}:
+                    raise ValueError(f"Unsupported filter operator in {value}")
+                value = value["$eq"]
+            flat[key] = value
+    return flat
+
+
+class _Records:
+    """
+    Read-only sequence of variable-length records: the bytes of every record
+    back to back in one memory-mapped file, with their boundaries in a
+    memory-mapped offsets column. Items are decoded on access, so workers
+    share the page cache instead of each parsing the corpus into its heap.
+    """
+
+    def __init__(self, path: Path, offsets: np.ndarray, decode: Callable[[bytes], Any]):
+        self.offsets = offsets
+        self.decode = decode
+        with open(path, "rb") as f:
+            # mmap rejects empty files; an empty collection has nothing to read anyway
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> Any:
+        return self.decode(self.data[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def __iter__(self) -> Iterator[Any]:
+        return (self[row] for row in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+
+def _write_records(path: Path, records: Iterable[bytes]) -> list[int]:
+    """Write records back to back; returns the count + 1 boundaries between them."""
+    offsets = [0]
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(record)
+            offsets.append(offsets[-1] + len(record))
+    return offsets
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 codes with one float scale per row: row ~= codes * scale."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _normalized(vectors: Iterable) -> np.ndarray:
+    array = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(array, axis=-1, keepdims=True)
+    return array / np.where(norms == 0, 1, norms)
+
+
+class QuantizedVectorStore(VectorStore):
+    """
+    Read-only vector store over a memory-mapped, int8-quantized copy of the
+    collection, for corpora whose float index no longer fits comfortably in
+    every worker.
+
+      - every chunk vector is stored as int8 codes plus one scale (a quarter
+        of float32), and the full-precision vectors sit in a second file
+      - both are memory-mapped, so workers on one machine share a single copy
+        in the page cache instead of each holding the index in its heap
+      - chunk texts and metadata are memory-mapped too and decoded per row,
+        so only the documents a query returns are ever parsed
+      - a search scores all codes, then rescores the best `rescore` x k
+        candidates with their float vectors; only those rows of the float
+        file are read
+
+    Scores match Chroma's default l2 space on normalized vectors (distance
+    2 - 2 cos), so relevance thresholds carry over. The index is rebuilt
+    from the Chroma collection (see `ensure`), which stays the source of
+    truth; concurrent workers build it once, and never load a half-swapped copy.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        ids: list[str],
+        texts: Sequence[str],
+        metadatas: Sequence[dict],
+        codes: np.ndarray,
+        scales: np.ndarray,
+        vectors: np.ndarray,
+        rescore: int = QUANTIZED_RESCORE,
+    ):
+        self.embedding = embedding
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.rescore = rescore
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._masks: dict[tuple, np.ndarray] = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    # --- building and loading -------------------------------------------------
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return all((path / name).exists() for name in _FILES)
+
+    @classmethod
+    def fingerprint(cls, path: Path) -> str | None:
+        """Fingerprint of the collection the index was built from, None if there is no complete index."""
+        # An index missing a file (e.g. written in an older layout) is rebuilt
+        if not cls.exists(path):
+            return None
+        try:
+            return json.loads((path / "meta.json").read_text(encoding="utf-8"))["fingerprint"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def write(
+        cls,
+        path: Path,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict],
+        batches: Iterable[np.ndarray],
+        dim: int,
+        fingerprint: str | None = None,
+    ) -> None:
+        """Write an index from float vectors arriving in batches; the files are swapped in once complete."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Private to this build, so concurrent builds never touch each other's files
+        tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f"{path.name}."))
+        try:
+            cls._write_files(tmp, ids, texts, metadatas, batches, dim, fingerprint)
+            # Loaders hold the shared lock, so they see either every old file or every new one
+            with _locked(path, "swap"):
+                path.mkdir(exist_ok=True)
+                for name in _FILES:
+                    os.replace(tmp / name, path / name)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @staticmethod
+    def _write_files(
+        tmp: Path,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict],
+        batches: Iterable[np.ndarray],
+        dim: int,
+        fingerprint: str | None,
+    ) -> None:
+        count = len(ids)
+        codes = np.lib.format.open_memmap(tmp / "codes.npy", mode="w+", dtype=np.int8, shape=(count, dim))
+        scales = np.lib.format.open_memmap(tmp / "scales.npy", mode="w+", dtype=np.float32, shape=(count,))
+        vectors = np.lib.format.open_memmap(tmp / "vectors.npy", mode="w+", dtype=np.float32, shape=(count, dim))
+        start = 0
+        for batch in batches:
+            batch = _normalized(batch)
+            end = start + len(batch)
+            vectors[start:end] = batch
+            codes[start:end], scales[start:end] = quantize(batch)
+            start = end
+        if start != count:
+            raise ValueError(f"Expected {count} vectors, got {start}")
+        for array in (codes, scales, vectors):
+            array.flush()
+        del codes, scales, vectors
+        (tmp / "ids.json").write_text(json.dumps(ids), encoding="utf-8")
+        text_offsets = _write_records(tmp / "texts.bin", (text.encode("utf-8") for text in texts))
+        meta_offsets = _write_records(tmp / "metadatas.bin", (json.dumps(m).encode("utf-8") for m in metadatas))
+        np.save(tmp / "offsets.npy", np.array([text_offsets, meta_offsets], dtype=np.int64))
+        (tmp / "meta.json").write_text(
+            json.dumps({"fingerprint": fingerprint, "count": count, "dim": dim}), encoding="utf-8"
+        )
+
+    @classmethod
+    def ensure(cls, vectorstore, path: Path, fingerprint: str) -> bool:
+        """Rebuild the index unless it was built from a collection with this fingerprint; True if it was rebuilt."""
+        if cls.fingerprint(path) == fingerprint:
+            return False
+        with _locked(path, "build"):
+            # Another worker may have rebuilt it while this one waited for the lock
+            if cls.fingerprint(path) == fingerprint:
+                return False
+            cls.build(vectorstore, path, fingerprint)
+        return True
+
+    @classmethod
+    def build(cls, vectorstore, path: Path, fingerprint: str | None = None) -> None:
+        """Export a Chroma collection into a quantized index at `path`, reading it in pages."""
+        ids, texts, metadatas, vectors = [], [], [], []
+        total = vectorstore._collection.count()
+        if not total:
+            raise ValueError("The collection is empty; run `python ingest.py` first")
+        for offset in range(0, total, BUILD_BATCH):
+            data = vectorstore.get(include=["documents", "metadatas", "embeddings"], limit=BUILD_BATCH, offset=offset)
+            ids += data["ids"]
+            texts += data["documents"]
+            metadatas += [m or {} for m in data["metadatas"]]
+            vectors.append(np.asarray(data["embeddings"], dtype=np.float32))
+        cls.write(path, ids, texts, metadatas, vectors, vectors[0].shape[1], fingerprint)
+
+    @classmethod
+    def load(cls, path: Path, embedding: Embeddings, rescore: int = QUANTIZED_RESCORE) -> "QuantizedVectorStore":
+        # Mapped files stay valid after a rebuild replaces them; this process keeps the old copy until it reloads
+        with _locked(path, "swap", exclusive=False):
+            ids = json.loads((path / "ids.json").read_text(encoding="utf-8"))
+            offsets = np.load(path / "offsets.npy", mmap_mode="r")
+            texts = _Records(path / "texts.bin", offsets[0], bytes.decode)
+            metadatas = _Records(path / "metadatas.bin", offsets[1], json.loads)
+            codes = np.load(path / "codes.npy", mmap_mode="r")
+            scales = np.load(path / "scales.npy", mmap_mode="r")
+            vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        if not len(ids) == len(texts) == len(metadatas) == len(codes) == len(scales) == len(vectors):
+            raise ValueError(f"Quantized index at {path} is inconsistent; rebuild it")
+        return cls(embedding, ids, texts, metadatas, codes, scales, vectors, rescore)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        path: Path | str = "quantized_index",
+        **kwargs: Any,
+    ) -> "QuantizedVectorStore":
+        vectors = np.asarray(embedding.embed_documents(list(texts)), dtype=np.float32)
+        ids = ids or [str(i) for i in range(len(texts))]
+        cls.write(Path(path), ids, list(texts), metadatas or [{} for _ in texts], [vectors], vectors.shape[1])
+        return cls.load(Path(path), embedding, **kwargs)
+
+    def add_texts(self, texts: Iterable[str], metadatas: list[dict] | None = None, **kwargs: Any) -> list[str]:
+        raise NotImplementedError("The quantized index is read-only; ingest into Chroma and rebuild it")
+
+    # --- search ---------------------------------------------------------------
+
+    def _mask(self, where: dict | None) -> np.ndarray | None:
+        flat = _flat_filter(where)
+        if flat is None:
+            return None
+        key = tuple(sorted(flat.items()))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.fromiter((matches(m, flat) for m in self.metadatas), dtype=bool, count=len(self.metadatas))
+            if len(self._masks) >= MAX_CACHED_FILTERS:
+                self._masks.clear()
+            self._masks[key] = mask
+        return mask
+
+    def search(
+        self, query: list[float], k: int, where: dict | None = None, rescore: int | None = None
+    ) -> list[tuple[int, float]]:
+        """(row, cosine similarity) of the top `k` rows: int8 pass over every row, float rescoring of the best."""
+        count = len(self.ids)
+        if not count or k <= 0:
+            return []
+        q = _normalized(query)
+        approx = np.empty(count, dtype=np.float32)
+        for start in range(0, count, BLOCK_ROWS):
+            block = self.codes[start:start + BLOCK_ROWS]
+            approx[start:start + len(block)] = (block.astype(np.float32) @ q) * self.scales[start:start + len(block)]
+        mask = self._mask(where)
+        if mask is not None:
+            approx[~mask] = -np.inf
+            count = int(mask.sum())
+            if not count:
+                return []
+
+        candidates = min(max(k * (rescore or self.rescore), k), count)
+        top = np.argpartition(-approx, candidates - 1)[:candidates]
+        # Sorted rows read the float file front to back
+        top.sort()
+        exact = np.asarray(self.vectors[top]) @ q
+        order = np.argsort(-exact)[:k]
+        return [(int(top[i]), float(exact[i])) for i in order]
+
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=self.metadatas[row], id=self.ids[row])
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: list[float], k: int = 4, filter: dict | None = None, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        """Documents with Chroma-style l2 distances (2 - 2 cos); lower is closer."""
+        hits = self.search(embedding, k, filter, kwargs.get("rescore"))
+        return [(self._document(row), 2.0 - 2.0 * similarity) for row, similarity in hits]
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, filter: dict | None = None, **kwargs: Any
+    ) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter, **kwargs)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: dict | None = None, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, filter, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Same mapping Chroma uses for its default l2 space
+        return self._euclidean_relevance_score_fn
+
+    def get(self, ids: list[str] | None = None, include: list[str] | None = None) -> dict:
+        """Chroma-compatible lookup by id, e.g. for the context packer's stored embeddings."""
+        include = include or ["documents", "metadatas"]
+        rows = [self._positions[i] for i in ids if i in self._positions] if ids is not None else range(len(self.ids))
+        result: dict[str, Any] = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.texts[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [np.asarray(self.vectors[row]).tolist() for row in rows]
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "chunks": len(self.ids),
+            "dim": int(self.codes.shape[1]) if len(self.codes) else 0,
+            "int8_bytes": int(self.codes.nbytes + self.scales.nbytes),
+            "float_bytes": int(self.vectors.nbytes),
+            "docs_bytes": sum(getattr(records, "nbytes", 0) for records in (self.texts, self.metadatas)),
+            "rescore": self.rescore,
+        }
@@ -0,0 +1,131 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from observability import span
+from text_utils import normalize_text
+
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "16"))
+EMBED_MAX_WAIT = float(os.getenv("EMBED_MAX_WAIT_MS", "5")) / 1000
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so query embeddings are cheap to repeat.
+
+      - query vectors are kept in an LRU cache keyed by normalized text, so
+        suggestion prompts clicked back verbatim skip the forward pass
+      - cache misses that arrive within `max_wait` seconds of each other are
+        embedded together in one batch; identical queries in flight share it
+      - `warm_up()` runs a dummy forward pass so the first user does not pay
+        for the model's lazy initialization
+
+    Queries are batched through `embed_documents`, which matches `embed_query`
+    for sentence-transformers models (no query instruction). Document
+    embedding passes straight through.
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        cache_size: int = EMBED_CACHE_SIZE,
+        max_batch_size: int = EMBED_MAX_BATCH,
+        max_wait: float = EMBED_MAX_WAIT,
+    ):
+        self.base = base
+        self.cache_size = cache_size
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.embedded = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                self._queue.put(key)
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._worker.start()
+        # Cache misses only: batching delay plus the forward pass
+        with span("embedding"):
+            return future.result()
+
+    def warm_up(self) -> None:
+        start = time.perf_counter()
+        self.base.embed_documents(["warm-up"])
+        logger.info("Embedding model warmed up in %.2fs", time.perf_counter() - start)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.base.embed_documents(batch)
+            except Exception as e:
+                with self._lock:
+                    futures = [self._inflight.pop(key) for key in batch]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                self.embedded += len(batch)
+                futures = [self._inflight.pop(key) for key in batch]
+                for key, vector in zip(batch, vectors):
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "batches": self.batches,
+                "avg_batch_size": round(self.embedded / self.batches, 2) if self.batches else 0.0,
+            }
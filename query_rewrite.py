@@ -0,0 +1,154 @@
+import asyncio
+import os
+import re
+import threading
+from typing import Callable
+
+from langchain_core.documents import Document
+
+from observability import span
+
+
+REWRITE_CLOSE_THRESHOLD = float(os.getenv("REWRITE_CLOSE_THRESHOLD", "0.75"))
+
+_PRONOUN = r"(it|them|this|that|these|those)"
+# Phrases that only make sense as follow-ups ("tell me more", "what about ...", "the second one"). Single
+# words such as "again" or "continue" are left out: they are just as common in standalone questions
+FOLLOW_UP_PATTERN = re.compile(
+    rf"\b(tell me more|(more|expand|elaborate) (about|on) {_PRONOUN}|go on|what about|how about|what else|"
+    rf"anything else|{_PRONOUN} again|same (thing|question)|the (above|previous|former|latter)|"
+    r"(mentioned|said) (above|earlier|before)|you (said|mentioned|suggested|recommended)|"
+    r"(first|second|third|last) (one|option|point|step|suggestion))\b",
+    flags=re.IGNORECASE,
+)
+# Pronouns in reference position: opening the question after at most a few question words, optionally
+# through "[noun] of" ("is that realistic?", "which of these options ...", "what part of that plan ..."),
+# or closing it ("how do I price it?"). Mid-sentence determiners as in "how do I price this kind of
+# product?" do not count
+REFERENCE_PATTERN = re.compile(
+    r"^\s*(?:(?:and|but|so|also|is|are|was|were|do|does|did|can|could|should|would|will|how|why|what|when|"
+    r"where|which|much|many)\s+){0,3}(?:(?:\w+\s+)?of\s+)?"
+    r"(it|its|they|them|their|this|that|these|those|he|she|his|her)\b"
+    rf"|\b{_PRONOUN}\s*[?.!]*\s*$",
+    flags=re.IGNORECASE,
+)
+MIN_STANDALONE_WORDS = 4
+
+
+def needs_rewrite(query: str) -> bool:
+    """Cheap check: very short follow-ups and back-references need the chat history to make sense."""
+    query = re.sub(r"^\s*Query:\s*", "", query)
+    return (
+        len(query.split()) < MIN_STANDALONE_WORDS
+        or FOLLOW_UP_PATTERN.search(query) is not None
+        or REFERENCE_PATTERN.search(query) is not None
+    )
+
+
+class QueryRewriter:
+    """
+    Decides whether a follow-up question has to be rewritten into a standalone
+    one before retrieval, and avoids the extra LLM round-trip when it does not:
+
+      - first turn, or no back-references in the query: use it as is
+      - otherwise the rewrite and a retrieval on the raw query start together;
+        if the raw query's best match is already at least `close_threshold`
+        relevant, the rewrite is cancelled and the raw results are used
+
+    Counts how often each path is taken.
+    """
+
+    def __init__(
+        self,
+        rewrite_chain,
+        search_with_scores: Callable[[str], list[tuple[Document, float]]],
+        close_threshold: float = REWRITE_CLOSE_THRESHOLD,
+    ):
+        self.rewrite_chain = rewrite_chain
+        self.search_with_scores = search_with_scores
+        self.close_threshold = close_threshold
+        self._lock = threading.Lock()
+        self.counts = {"first_turn": 0, "no_reference": 0, "close_match": 0, "rewritten": 0}
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self.counts[path] += 1
+
+    async def standalone(
+        self,
+        query: str,
+        chat_history: list,
+        search_with_scores: Callable[[str], list[tuple[Document, float]]] | None = None,
+        config: dict | None = None,
+    ) -> tuple[str, list[Document] | None]:
+        """
+        Return (question to retrieve with, documents already retrieved for it or None).
+        `search_with_scores` overrides the default search, e.g. for a filtered retriever;
+        `config` is passed to the rewrite chain.
+        """
+        search = search_with_scores or self.search_with_scores
+        if not self._may_need_rewrite(query, chat_history):
+            return query, None
+
+        rewrite = asyncio.create_task(self._rewrite(query, chat_history, config))
+        try:
+            scored = await asyncio.to_thread(search, query)
+        except BaseException:
+            rewrite.cancel()
+            raise
+        if scored and max(score for _, score in scored) >= self.close_threshold:
+            # Cancelling the task closes the request, so Ollama stops generating
+            rewrite.cancel()
+            self._count("close_match")
+            return query, [doc for doc, _ in scored]
+
+        self._count("rewritten")
+        return await rewrite, None
+
+    def standalone_sync(
+        self,
+        query: str,
+        chat_history: list,
+        search_with_scores: Callable[[str], list[tuple[Document, float]]] | None = None,
+        config: dict | None = None,
+    ) -> tuple[str, list[Document] | None]:
+        """
+        Blocking `standalone` for worker threads without an event loop (e.g. prefetch):
+        the raw retrieval runs first and the rewrite only if it is not a close match.
+        The LLM's async client belongs to the server's event loop, so it is never driven from here.
+        """
+        search = search_with_scores or self.search_with_scores
+        if not self._may_need_rewrite(query, chat_history):
+            return query, None
+        scored = search(query)
+        if scored and max(score for _, score in scored) >= self.close_threshold:
+            self._count("close_match")
+            return query, [doc for doc, _ in scored]
+        self._count("rewritten")
+        with span("rewrite"):
+            return self.rewrite_chain.invoke({"input": query, "chat_history": chat_history}, config=config), None
+
+    def _may_need_rewrite(self, query: str, chat_history: list) -> bool:
+        """Count and take the fast paths that need no retrieval."""
+        if not chat_history:
+            self._count("first_turn")
+            return False
+        if not needs_rewrite(query):
+            self._count("no_reference")
+            return False
+        return True
+
+    async def _rewrite(self, query: str, chat_history: list, config: dict | None) -> str:
+        with span("rewrite"):
+            return await self.rewrite_chain.ainvoke({"input": query, "chat_history": chat_history}, config=config)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            follow_ups = total - self.counts["first_turn"]
+            return {
+                **self.counts,
+                "rewrite_rate": round(self.counts["rewritten"] / total, 4) if total else 0.0,
+                # Share of follow-ups answered without waiting for a rewrite; near 0 means the pattern is too broad
+                "skip_rate": round((follow_ups - self.counts["rewritten"]) / follow_ups, 4) if follow_ups else 0.0,
+            }
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from text_utils import normalize_text
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+
+
+class SemanticCache:
+    """
+    In-memory cache of answers keyed by question meaning rather than exact text.
+
+    Questions are embedded and L2-normalized into a fixed-size matrix, so a
+    lookup is one matrix-vector product over at most `max_entries` rows.
+    Entries expire after `ttl` seconds; when full, the least recently used
+    entry's row is reused.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], list[float]],
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = SEMANTIC_CACHE_TTL,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors: np.ndarray | None = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        # row -> (question, value, stored_at); order is least to most recently used
+        self._entries: OrderedDict[int, tuple[str, dict, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def vector(self, question: str) -> np.ndarray:
+        v = np.asarray(self.embed(normalize_text(question).lower()), dtype=np.float32)
+        return v / (np.linalg.norm(v) or 1.0)
+
+    def lookup(self, question: str) -> tuple[dict | None, np.ndarray]:
+        """Return (cached value or None, question vector); pass the vector on to `store`."""
+        v = self.vector(question)
+        now = time.time()
+        with self._lock:
+            if self._vectors is not None and self._valid.any():
+                scores = self._vectors @ v
+                scores[~self._valid] = -1.0
+                row = int(np.argmax(scores))
+                if scores[row] >= self.threshold:
+                    _, value, stored_at = self._entries[row]
+                    if now - stored_at <= self.ttl:
+                        self._entries.move_to_end(row)
+                        self.hits += 1
+                        return value, v
+                    self._drop(row)
+            self.misses += 1
+        return None, v
+
+    def store(self, vector: np.ndarray, question: str, value: dict) -> None:
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            row = self._free_row()
+            self._vectors[row] = vector
+            self._valid[row] = True
+            self._entries[row] = (question, value, time.time())
+
+    def _free_row(self) -> int:
+        now = time.time()
+        for row, (_, _, stored_at) in list(self._entries.items()):
+            if now - stored_at > self.ttl:
+                self._drop(row)
+        free = np.flatnonzero(~self._valid)
+        if free.size:
+            return int(free[0])
+        row, _ = self._entries.popitem(last=False)
+        self._valid[row] = False
+        return row
+
+    def _drop(self, row: int) -> None:
+        self._entries.pop(row, None)
+        self._valid[row] = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, create_engine, delete, event, func, insert, select
+
+from text_utils import estimate_tokens
+
+
+SESSION_DB_URL = os.getenv("SESSION_DB_URL", "sqlite:///sessions.db")
+SESSION_MAX_IN_MEMORY = int(os.getenv("SESSION_MAX_IN_MEMORY", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+SESSION_MAX_TOKENS = int(os.getenv("SESSION_MAX_TOKENS", "6000"))
+SESSION_PRUNE_INTERVAL = 300.0
+
+metadata = MetaData()
+chat_messages = Table(
+    "chat_messages",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("session_id", String(128), index=True, nullable=False),
+    Column("message", Text, nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+
+def resolve_session_id(value) -> str:
+    """The client's session id, or a new one for the client to send back on later turns."""
+    value = str(value or "").strip()
+    return value[:128] if value else uuid.uuid4().hex
+
+
+class SessionHistory(BaseChatMessageHistory):
+    """Chat history of one session, backed by a SessionStore."""
+
+    def __init__(self, store: "SessionStore", session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.store.load(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+
+class SessionStore:
+    """
+    Per-session chat histories in a SQL database, with a bounded in-memory cache.
+
+    Every message is written through to the database, so several uvicorn
+    workers pointed at the same SESSION_DB_URL (a local SQLite file by default)
+    serve the same sessions. At most `max_sessions` windows are kept in memory,
+    evicted least-recently-used or after `idle_ttl` seconds. A cached window is
+    reused only while no worker has appended to that session since. Sessions
+    without a new message for `idle_ttl` seconds are also deleted from the
+    database, checked at most every SESSION_PRUNE_INTERVAL seconds.
+
+    `messages` returns the last `max_messages` messages, trimmed further from
+    the oldest end to about `max_tokens` tokens.
+    """
+
+    def __init__(
+        self,
+        url: str = SESSION_DB_URL,
+        max_sessions: int = SESSION_MAX_IN_MEMORY,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_messages: int = SESSION_MAX_MESSAGES,
+        max_tokens: int = SESSION_MAX_TOKENS,
+    ):
+        connect_args = {"check_same_thread": False, "timeout": 30} if url.startswith("sqlite") else {}
+        self.engine = create_engine(url, connect_args=connect_args)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_wal)
+        metadata.create_all(self.engine)
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        # session_id -> (last message id, windowed messages, last access)
+        self._cache: OrderedDict[str, tuple[int, list[BaseMessage], float]] = OrderedDict()
+        self._last_prune = 0.0
+
+    def get(self, session_id: str) -> SessionHistory:
+        return SessionHistory(self, session_id)
+
+    def load(self, session_id: str) -> list[BaseMessage]:
+        with self.engine.connect() as conn:
+            version = conn.execute(
+                select(func.max(chat_messages.c.id)).where(chat_messages.c.session_id == session_id)
+            ).scalar() or 0
+            with self._lock:
+                cached = self._cache.get(session_id)
+                if cached is not None and cached[0] == version:
+                    self._cache[session_id] = (version, cached[1], time.time())
+                    self._cache.move_to_end(session_id)
+                    return list(cached[1])
+
+            rows = conn.execute(
+                select(chat_messages.c.message)
+                .where(chat_messages.c.session_id == session_id)
+                .order_by(chat_messages.c.id.desc())
+                .limit(self.max_messages)
+            ).scalars().all()
+
+        messages = self._window(messages_from_dict([json.loads(r) for r in reversed(rows)]))
+        with self._lock:
+            self._cache[session_id] = (version, messages, time.time())
+            self._cache.move_to_end(session_id)
+            self._evict()
+        return list(messages)
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        now = time.time()
+        rows = [
+            {"session_id": session_id, "message": json.dumps(m), "created_at": now}
+            for m in messages_to_dict(list(messages))
+        ]
+        with self.engine.begin() as conn:
+            conn.execute(insert(chat_messages), rows)
+        with self._lock:
+            self._cache.pop(session_id, None)
+        self.maybe_prune()
+
+    def maybe_prune(self) -> None:
+        """Prune at most once per SESSION_PRUNE_INTERVAL seconds (per worker)."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune < SESSION_PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        self.prune()
+
+    def prune(self) -> int:
+        """Delete every session whose latest message is older than `idle_ttl`; returns the rows removed."""
+        idle = (
+            select(chat_messages.c.session_id)
+            .group_by(chat_messages.c.session_id)
+            .having(func.max(chat_messages.c.created_at) < time.time() - self.idle_ttl)
+        )
+        with self.engine.begin() as conn:
+            removed = conn.execute(delete(chat_messages).where(chat_messages.c.session_id.in_(idle))).rowcount
+        return removed or 0
+
+    def clear(self, session_id: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(chat_messages).where(chat_messages.c.session_id == session_id))
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def _window(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        messages = messages[-self.max_messages:]
+        total = sum(estimate_tokens(str(m.content)) for m in messages)
+        # Always keep the latest exchange, even if it alone exceeds the budget
+        while len(messages) > 2 and total > self.max_tokens:
+            total -= estimate_tokens(str(messages[0].content))
+            messages = messages[1:]
+        return messages
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.idle_ttl
+        while self._cache:
+            session_id, (_, _, last_access) = next(iter(self._cache.items()))
+            if len(self._cache) <= self.max_sessions and last_access >= cutoff:
+                break
+            self._cache.pop(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions_in_memory": len(self._cache), "max_sessions": self.max_sessions}
+
+
+def _sqlite_wal(dbapi_connection, _record) -> None:
+    # WAL lets several worker processes read while one writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
@@ -0,0 +1,61 @@
+import json
+import re
+from typing import Callable, Iterable, Iterator
+
+
+# Everything after this marker is follow-up prompts, not part of the spoken answer
+SUGGESTIONS_MARKER = re.compile(r"Next Interaction Prompts", flags=re.IGNORECASE)
+# "N." starting a numbered item; the whitespace after it rules out numbers such as "2.0"
+ITEM_MARKER = re.compile(r"\d+\.(?=\s)")
+
+
+class SuggestionStream:
+    """
+    Streaming-safe wrapper around a `parse_response_and_suggestions` function.
+
+    Tokens are fed in as the LLM produces them. Once the text has passed the
+    'Next Interaction Prompts' marker, suggestion N is complete as soon as the
+    "N+1." that starts the next item has arrived, and is returned exactly once.
+    The last suggestion is only released by `close()`, when the stream has ended.
+    """
+
+    def __init__(
+        self,
+        parse: Callable[[str], tuple[str, list[str]]],
+        clean: Callable[[str], str] = lambda text: text,
+    ):
+        self.parse = parse
+        self.clean = clean
+        self.raw = ""
+        self.emitted = 0
+
+    def feed(self, token: str) -> list[str]:
+        """Add a token and return suggestions that became complete with it."""
+        self.raw += token
+        # A suggestion can only be closed off by the "N." that starts the next one, seen once its space arrives
+        if not re.search(r"[.\s]", token):
+            return []
+        text = self.clean(self.raw)
+        marker = SUGGESTIONS_MARKER.search(text)
+        if marker is None:
+            return []
+        complete = len(ITEM_MARKER.findall(text, marker.end())) - 1
+        if complete <= self.emitted:
+            return []
+        _, suggestions = self.parse(text)
+        new = suggestions[self.emitted:complete]
+        self.emitted += len(new)
+        return new
+
+    def close(self) -> tuple[str, list[str], list[str]]:
+        """Parse the full text; returns (main_text, all_suggestions, not_yet_emitted)."""
+        main_text, suggestions = self.parse(self.clean(self.raw))
+        remaining = suggestions[self.emitted:]
+        self.emitted = len(suggestions)
+        return main_text, suggestions, remaining
+
+
+def ndjson(events: Iterable[dict]) -> Iterator[bytes]:
+    """Encode events as newline-delimited JSON for a StreamingResponse."""
+    for event in events:
+        yield (json.dumps(event) + "\n").encode("utf-8")
@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 import tempfile
 import os
+import uuid
 
 # Configure your FastAPI base URL
 API_BASE = "http://10.7.0.28:5505"
@@ -21,6 +22,17 @@ st.markdown(
 
 
 
+# One server-side conversation history per browser session
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+SESSION_ID = st.session_state["session_id"]
+
+
+def audio_format(url: str) -> str:
+    """Content type of a reply's audio from its extension (OGG/Opus by default, WAV or MP3 if so configured)."""
+    return {".ogg": "audio/ogg", ".mp3": "audio/mpeg"}.get(os.path.splitext(url)[1], "audio/wav")
+
+
 # --- TAB SELECTION ---
 tab = st.sidebar.radio("Mode", ["Text Query", "Audio Query"])
 
@@ -36,7 +48,7 @@ if tab == "Text Query":
             with st.spinner("Fetching advice…"):
                 resp = requests.post(
                     f"{API_BASE}/ask",
-                    json={"query": user_input},
+                    json={"query": user_input, "session_id": SESSION_ID},
                     timeout=60,
                 )
             if resp.status_code != 200:
@@ -50,7 +62,7 @@ if tab == "Text Query":
                     for idx, s in enumerate(data["suggestions"], 1):
                         st.write(f"{idx}. {s}")
                 if data.get("audio_url"):
-                    st.audio(data["audio_url"])
+                    st.audio(data["audio_url"], format=audio_format(data["audio_url"]))
 
 else:
     st.subheader("🎤 Audio Query")
@@ -62,34 +74,30 @@ else:
         st.audio(audio_bytes, format="audio/wav")
         if st.button("Transcribe & Ask"):
             with st.spinner("Transcribing and asking…"):
-                # 1) Upload to /whisper
+                # Transcription and answer in one request to /voice-ask
                 files = {"file": ("query.wav", audio_bytes, "audio/wav")}
-                tresp = requests.post(f"{API_BASE}/whisper", files=files, timeout=60)
-                if tresp.status_code != 200:
-                    st.error(f"Transcription Error: {tresp.text}")
-                else:
-                    text = tresp.json().get("transcription", "")
-                    st.markdown("**Transcription:**")
-                    st.write(text)
-
-                    # 2) Send transcription to /ask
-                    aresp = requests.post(
-                        f"{API_BASE}/ask",
-                        json={"query": text},
-                        timeout=60,
-                    )
-                    if aresp.status_code != 200:
-                        st.error(f"Asking Error: {aresp.text}")
-                    else:
-                        data = aresp.json()
-                        st.markdown("**Mentor Response:**")
-                        st.write(data["response"])
-                        if data.get("suggestions"):
-                            st.markdown("**Follow-up Prompts:**")
-                            for idx, s in enumerate(data["suggestions"], 1):
-                                st.write(f"{idx}. {s}")
-                        if data.get("audio_url"):
-                            st.audio(data["audio_url"])
+                resp = requests.post(
+                    f"{API_BASE}/voice-ask",
+                    files=files,
+                    data={"session_id": SESSION_ID},
+                    timeout=120,
+                )
+            if resp.status_code != 200:
+                st.error(f"API Error: {resp.text}")
+            else:
+                data = resp.json()
+                st.markdown("**Transcription:**")
+                st.write(data.get("transcription", ""))
+                st.markdown("**Mentor Response:**")
+                st.write(data["response"])
+                if data.get("suggestions"):
+                    st.markdown("**Follow-up Prompts:**")
+                    for idx, s in enumerate(data["suggestions"], 1):
+                        st.write(f"{idx}. {s}")
+                if data.get("audio_url"):
+                    st.audio(data["audio_url"], format=audio_format(data["audio_url"]))
+                if data.get("timings"):
+                    st.caption(" · ".join(f"{stage} {seconds:.2f}s" for stage, seconds in data["timings"].items()))
 
 # --- STYLING ---
 st.markdown(
@@ -0,0 +1,36 @@
+import pytest
+
+from query_rewrite import needs_rewrite
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        # Back-references: only meaningful with the chat history
+        ("Tell me more about that.", True),
+        ("Query: How do I price it?", True),
+        ("Is that realistic for a bakery?", True),
+        ("Which of these options works best for a bakery?", True),
+        ("Which one of those would you start with?", True),
+        ("What part of that plan should I do first?", True),
+        ("How many of them should I interview?", True),
+        ("What are their fees?", True),
+        ("What about the second one?", True),
+        ("Can you explain that again for a bakery?", True),
+        ("Could you expand on that with an example?", True),
+        ("Why is that?", True),
+        ("Pricing?", True),
+        # Standalone questions, including pronouns used as determiners and single follow-up words
+        ("How do I price this kind of SaaS product?", False),
+        ("What are common mistakes first-time founders make with cash flow?", False),
+        ("How can I find a co-founder with complementary skills?", False),
+        ("Should I try again after my first startup failed?", False),
+        ("How do I continue growing after the first year?", False),
+        ("How fast should I expand into a second city?", False),
+        ("Should I raise money earlier than planned?", False),
+        ("I want to learn more about marketing for a bakery", False),
+        ("Can you explain the lean startup approach in simple terms?", False),
+    ],
+)
+def test_needs_rewrite(query, expected):
+    assert needs_rewrite(query) is expected
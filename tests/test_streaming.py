@@ -0,0 +1,56 @@
+import re
+
+import pytest
+
+from streaming import SuggestionStream
+
+
+def parse(raw: str) -> tuple[str, list[str]]:
+    # Same shape as the servers' parse_response_and_suggestions
+    parts = re.split(r"Next Interaction Prompts\s*:?\s*", raw, maxsplit=1, flags=re.IGNORECASE)
+    suggestions = []
+    if len(parts) > 1:
+        suggestions = re.findall(r"\d+\.\s*(.+?)(?=(?:\s*\d+\.|$))", parts[1], flags=re.DOTALL)
+        suggestions = [s.strip().replace("\n", " ") for s in suggestions if s.strip()]
+    return parts[0].strip(), suggestions
+
+
+ANSWER = (
+    "Start small and talk to customers. Version 2.0 can wait.\n\n"
+    "**Next Interaction Prompts:**\n"
+    "1. How do I find my first customers?\n"
+    "2. What should I ask in interviews?\n"
+    "3. How do I price an early offer?"
+)
+
+
+def tokens(text: str) -> list[str]:
+    return re.findall(r"\S+|\s+", text)
+
+
+@pytest.mark.parametrize("clean", [lambda text: text, lambda text: text.replace("\n", "").replace("*", " ")])
+def test_each_suggestion_arrives_with_the_next_marker(clean):
+    stream = SuggestionStream(parse, clean)
+    emitted_at = {}
+    for token in tokens(ANSWER):
+        for suggestion in stream.feed(token):
+            emitted_at[suggestion] = stream.raw
+
+    first = "How do I find my first customers?"
+    second = "What should I ask in interviews?"
+    third = "How do I price an early offer?"
+    assert list(emitted_at) == [first, second]
+    assert emitted_at[first].endswith("2. ")
+    assert emitted_at[second].endswith("3. ")
+
+    main_text, suggestions, remaining = stream.close()
+    assert suggestions == [first, second, third]
+    assert remaining == [third]
+    assert "2.0" in main_text
+
+
+def test_nothing_before_the_suggestions_marker():
+    stream = SuggestionStream(parse)
+    emitted = [s for token in tokens("Step 1. Do this. Step 2. Do that. ") for s in stream.feed(token)]
+    assert emitted == []
+    assert stream.close()[2] == []
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from math import gcd
+
+import numpy as np
+import torch
+import whisper
+from fastapi import WebSocket, WebSocketDisconnect
+from scipy.signal import resample_poly
+
+from audio_io import SAMPLE_RATE, EnergySegmenter
+
+
+WHISPER_MAX_BATCH = int(os.getenv("WHISPER_MAX_BATCH", "8"))
+WHISPER_MAX_WAIT = float(os.getenv("WHISPER_MAX_WAIT_MS", "50")) / 1000
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionBatcher:
+    """
+    Collects transcription requests that arrive within `max_wait` seconds of
+    each other and runs them through Whisper as one padded batch.
+
+    Clips of up to 30 s are padded to Whisper's fixed window, stacked into one
+    mel batch and decoded together. Longer clips fall back to `model.transcribe`
+    in the same worker. Only one batch runs at a time, so the model is never
+    used concurrently. Requests that queue up during a batch form the next one.
+    """
+
+    def __init__(self, model, max_batch_size: int = WHISPER_MAX_BATCH, max_wait: float = WHISPER_MAX_WAIT, fp16: bool = False):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.fp16 = fp16
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+
+    async def transcribe(self, audio: np.ndarray) -> str:
+        """Transcribe 16 kHz mono float32 audio; resolves when its batch finishes."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [(audio, future) for audio, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                texts = await asyncio.to_thread(self.transcribe_batch, [audio for audio, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+    def transcribe_batch(self, audios: list[np.ndarray]) -> list[str]:
+        """Blocking: transcribe several clips, batching those that fit in one 30 s window."""
+        with self._lock:
+            self.batches += 1
+            self.requests += len(audios)
+
+        texts = [""] * len(audios)
+        short = []
+        for i, audio in enumerate(audios):
+            if len(audio) <= whisper.audio.N_SAMPLES:
+                short.append(i)
+            else:
+                texts[i] = self.model.transcribe(audio, fp16=self.fp16).get("text", "")
+
+        if short:
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audios[i]), n_mels=self.model.dims.n_mels)
+                for i in short
+            ]).to(self.model.device)
+            options = whisper.DecodingOptions(fp16=self.fp16, without_timestamps=True)
+            for i, result in zip(short, whisper.decode(self.model, mels, options)):
+                texts[i] = result.text
+        return texts
+
+    def warm_up(self) -> None:
+        """Blocking: decode one second of silence so the first real request does not pay for kernel setup."""
+        self.transcribe_batch([np.zeros(SAMPLE_RATE, dtype=np.float32)])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+            }
+
+
+async def stream_transcription(websocket: WebSocket, transcriber: TranscriptionBatcher) -> None:
+    """
+    WebSocket session for incremental transcription.
+
+    Client -> server:
+      optional text {"sample_rate": 48000} first (default 16000)
+      binary frames of 16-bit little-endian mono PCM, as they are recorded
+      text {"type": "end"} when the user stops recording
+    Server -> client:
+      {"type": "partial", "segment": i, "text": ...} as each speech segment is transcribed
+      {"type": "final", "text": ...} with all segments joined, after "end"
+      {"type": "error", "error": ...} before closing, if decoding or transcription fails
+    """
+    await websocket.accept()
+    segmenter: EnergySegmenter | None = None
+    sample_rate = SAMPLE_RATE
+    pending: asyncio.Queue = asyncio.Queue()
+    texts: list[str] = []
+
+    async def send_partials():
+        # Transcriptions run concurrently (and batch together); results go out in order
+        while (task := await pending.get()) is not None:
+            text = (await task).strip()
+            texts.append(text)
+            await websocket.send_json({"type": "partial", "segment": len(texts) - 1, "text": text})
+
+    async def transcribe(segment: np.ndarray) -> str:
+        if sample_rate != SAMPLE_RATE:
+            # Whole segments are resampled at once; resampling each frame leaves filter edges at every boundary
+            g = gcd(SAMPLE_RATE, sample_rate)
+            segment = await asyncio.to_thread(resample_poly, segment, SAMPLE_RATE // g, sample_rate // g)
+        return await transcriber.transcribe(segment.astype(np.float32, copy=False))
+
+    def submit(segment: np.ndarray) -> None:
+        pending.put_nowait(asyncio.create_task(transcribe(segment)))
+
+    sender = asyncio.create_task(send_partials())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                if segmenter is None:
+                    # Segmented at the client's rate; the sample rate is fixed from the first frame on
+                    segmenter = EnergySegmenter(sr=sample_rate)
+                samples = np.frombuffer(message["bytes"], np.int16).astype(np.float32) / 32768.0
+                for segment in segmenter.feed(samples):
+                    submit(segment)
+                continue
+
+            control = json.loads(message.get("text") or "{}")
+            if "sample_rate" in control and segmenter is None:
+                sample_rate = int(control["sample_rate"])
+            if control.get("type") == "end":
+                break
+
+        segment = segmenter.flush() if segmenter is not None else None
+        if segment is not None:
+            submit(segment)
+        pending.put_nowait(None)
+        await sender
+        await websocket.send_json({"type": "final", "text": " ".join(t for t in texts if t)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.exception("Streaming transcription failed")
+        try:
+            await websocket.send_json({"type": "error", "error": str(e)})
+            await websocket.close(code=1011)
+        except (WebSocketDisconnect, RuntimeError):
+            # The client is already gone
+            pass
+    finally:
+        sender.cancel()
@@ -0,0 +1,347 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+import wave
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import pyttsx3
+
+from audio_cache import AudioCache
+from observability import STAGE_SECONDS, TTS_QUEUE_DEPTH
+
+
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+TTS_MAX_QUEUE = int(os.getenv("TTS_MAX_QUEUE", "32"))
+TTS_SUBMIT_TIMEOUT = float(os.getenv("TTS_SUBMIT_TIMEOUT", "5"))
+# "stub" writes silence instead of speaking, for benchmarks on machines without a speech engine
+TTS_BACKEND = os.getenv("TTS_BACKEND", "pyttsx3")
+TTS_STUB_MS_PER_WORD = float(os.getenv("TTS_STUB_MS_PER_WORD", "5"))
+STUB_SAMPLE_RATE = 16000
+STUB_SECONDS_PER_WORD = 0.35
+
+# Part of every audio cache key: changing the voice must not serve old audio
+VOICE_SETTINGS = {"engine": TTS_BACKEND, "voice": "male"}
+
+# Per-process engine, created once by the pool initializer in each worker
+_engine = None
+
+
+def select_male_voice(engine) -> None:
+    """Choose a male voice (first male found)."""
+    for v in engine.getProperty("voices"):
+        if "male" in v.name.lower() or "male" in v.id:
+            engine.setProperty("voice", v.id)
+            break
+
+
+def _init_engine() -> None:
+    global _engine
+    if TTS_BACKEND == "stub":
+        return
+    _engine = pyttsx3.init()
+    select_male_voice(_engine)
+
+
+def _write_silence(text: str, out_path: str) -> None:
+    """Stub synthesis: silence as long as the text would take to say, after a delay per word."""
+    words = len(text.split())
+    time.sleep(words * TTS_STUB_MS_PER_WORD / 1000)
+    with wave.open(out_path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(STUB_SAMPLE_RATE)
+        out.writeframes(b"\0\0" * int(max(words, 1) * STUB_SECONDS_PER_WORD * STUB_SAMPLE_RATE))
+
+
+def synthesize_to_file(text: str, out_path: str) -> float:
+    """Worker task: synthesize `text` into `out_path`; returns seconds spent."""
+    if _engine is None:
+        _init_engine()
+    start = time.perf_counter()
+    if TTS_BACKEND == "stub":
+        _write_silence(text, out_path)
+    else:
+        _engine.save_to_file(text, out_path)
+        _engine.runAndWait()
+    return time.perf_counter() - start
+
+
+def concat_wavs(segments: list[Path], out_path: Path) -> None:
+    """Join WAV segments (same format, as produced by one TTS voice) into one file."""
+    with wave.open(str(out_path), "wb") as out:
+        for i, segment in enumerate(segments):
+            with wave.open(str(segment), "rb") as part:
+                if i == 0:
+                    out.setparams(part.getparams())
+                out.writeframes(part.readframes(part.getnframes()))
+
+
+# Abbreviations and list numbers that end in "." without ending a sentence
+_NON_TERMINAL = re.compile(r"(?:\b(?:e\.g|i\.e|etc|vs|Mr|Mrs|Ms|Dr|St|Inc|Ltd)|\b\d+)\.$", re.IGNORECASE)
+_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and releases it one complete sentence at a time."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, token: str) -> list[str]:
+        self.buffer += token
+        sentences = []
+        start = 0
+        for match in _BOUNDARY.finditer(self.buffer):
+            candidate = self.buffer[start:match.end()].strip()
+            if _NON_TERMINAL.search(candidate.rstrip("\"')]!?")):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> str:
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest
+
+
+class TTSQueueFull(RuntimeError):
+    """Raised when the TTS job queue stays full for longer than the submit timeout."""
+
+
+def _ping() -> int:
+    # Keeps a worker busy briefly so the pool has to start every process
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class TTSWorkerPool:
+    """
+    Long-lived TTS worker processes, each holding one pre-initialized pyttsx3
+    engine with the voice already selected. pyttsx3 keeps one engine per
+    process, so parallel synthesis needs processes rather than threads.
+
+    Jobs wait in a bounded queue: `submit` blocks for up to `submit_timeout`
+    seconds when it is full and then raises TTSQueueFull, or raises at once
+    with `block=False`.
+    """
+
+    def __init__(self, workers: int = TTS_WORKERS, max_queue: int = TTS_MAX_QUEUE, submit_timeout: float = TTS_SUBMIT_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._synth_total = 0.0
+        self._synth_max = 0.0
+        self._wait_total = 0.0
+
+    def start(self) -> None:
+        """Spawn every worker now so no request pays for engine initialization."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_engine,
+                )
+        warmups = [self._executor.submit(_ping) for _ in range(self.workers)]
+        for future in warmups:
+            future.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, text: str, out_path: str, block: bool = True) -> Future:
+        """Queue a synthesis job; the future resolves to the seconds spent synthesizing."""
+        if not self._slots.acquire(timeout=self.submit_timeout if block else 0):
+            raise TTSQueueFull(f"TTS queue full ({self.max_queue} jobs waiting)")
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            self._pending += 1
+        submitted = time.perf_counter()
+        try:
+            future = self._executor.submit(synthesize_to_file, text, out_path)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._finished(f, submitted))
+        return future
+
+    def _finished(self, future: Future, submitted: float) -> None:
+        self._slots.release()
+        elapsed = time.perf_counter() - submitted
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+                return
+            synth = future.result()
+            STAGE_SECONDS.labels("tts_synthesis").observe(synth)
+            STAGE_SECONDS.labels("tts_queue").observe(max(elapsed - synth, 0.0))
+            self._completed += 1
+            self._synth_total += synth
+            self._synth_max = max(self._synth_max, synth)
+            self._wait_total += max(elapsed - synth, 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": max(self._pending - self.workers, 0),
+                "in_flight": min(self._pending, self.workers),
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_synthesis_seconds": round(self._synth_total / done, 4),
+                "max_synthesis_seconds": round(self._synth_max, 4),
+                "avg_queue_wait_seconds": round(self._wait_total / done, 4),
+            }
+
+
+# Shared by every request in this server process
+tts_pool = TTSWorkerPool()
+TTS_QUEUE_DEPTH.set_function(lambda: tts_pool.stats()["queue_depth"])
+audio_cache = AudioCache(voice_settings=VOICE_SETTINGS)
+
+
+class SpeechPipeline:
+    """
+    Turns a streamed answer into audio while the LLM is still generating.
+
+    Each complete sentence is synthesized by `tts_pool` as soon as it arrives,
+    unless `cache` already holds audio for it. Text after `stop_marker`
+    (the follow-up prompts) is not spoken. `finish()` joins the segments
+    into one cached WAV file for the whole answer.
+
+    Sentences are queued without waiting, so a saturated pool never stalls
+    the token loop feeding the pipeline: a sentence the queue has no room
+    for is deferred and submitted again, waiting this time, by `finish()`.
+    Failed syntheses are skipped by `ready_segments()` and raised by `finish()`.
+    """
+
+    def __init__(
+        self,
+        clean: Callable[[str], str] = lambda text: text,
+        stop_marker: re.Pattern | None = None,
+        cache: AudioCache | None = None,
+    ):
+        self.clean = clean
+        self.stop_marker = stop_marker
+        self.cache = cache or audio_cache
+        self.splitter = SentenceSplitter()
+        self.spoken: list[str] = []
+        self.segments: list[Future] = []
+        # Indexes of segments the queue had no room for while streaming
+        self.deferred: set[int] = set()
+        self.stopped = False
+        self.released = 0
+
+    def feed(self, token: str) -> None:
+        if self.stopped:
+            return
+        for sentence in self.splitter.feed(token):
+            if self._stop_at_marker(sentence):
+                return
+            self._submit(sentence)
+        self._stop_at_marker(self.splitter.buffer)
+
+    def _stop_at_marker(self, text: str) -> bool:
+        """Speak what precedes the marker, then ignore the rest of the answer."""
+        match = self.stop_marker.search(text) if self.stop_marker is not None else None
+        if match is None:
+            return False
+        self._submit(text[:match.start()])
+        self.splitter.buffer = ""
+        self.stopped = True
+        return True
+
+    def _submit(self, sentence: str) -> None:
+        text = self.clean(sentence).strip()
+        if not re.search(r"[A-Za-z]", text):
+            return
+        try:
+            segment = self._cached_or_synthesize(text, block=False)
+        except TTSQueueFull as e:
+            segment = Future()
+            segment.set_exception(e)
+            self.deferred.add(len(self.segments))
+        self.spoken.append(text)
+        self.segments.append(segment)
+
+    def _cached_or_synthesize(self, text: str, block: bool = True) -> Future:
+        """Future resolving to the segment's path once it is in the cache."""
+        segment: Future = Future()
+        cached = self.cache.lookup(text)
+        if cached is not None:
+            segment.set_result(cached)
+            return segment
+
+        path = self.cache.path_for(text)
+        tmp = self.cache.temp_path(path)
+
+        def _store(job: Future) -> None:
+            try:
+                job.result()
+                os.replace(tmp, path)
+                segment.set_result(path)
+            except BaseException as e:
+                segment.set_exception(e)
+
+        tts_pool.submit(text, str(tmp), block=block).add_done_callback(_store)
+        return segment
+
+    def ready_segments(self) -> list[Path]:
+        """Segments finished since the last call, in speaking order; failed ones are left out."""
+        ready = []
+        while self.released < len(self.segments) and self.segments[self.released].done():
+            if self.released in self.deferred:
+                # Keeps the order: later segments wait until `finish()` has retried this one
+                break
+            segment = self.segments[self.released]
+            self.released += 1
+            if segment.exception() is None:
+                ready.append(segment.result())
+        return ready
+
+    def finish(self) -> Path | None:
+        """Wait for every segment and join them; None if nothing was spoken."""
+        if not self.stopped:
+            self._submit(self.splitter.flush())
+            self.stopped = True
+        if not self.spoken:
+            return None
+
+        full_text = " ".join(self.spoken)
+        cached = self.cache.lookup(full_text)
+        if cached is not None:
+            return cached
+
+        # The token loop is over, so deferred sentences can wait for room in the queue now
+        for index in sorted(self.deferred):
+            self.segments[index] = self._cached_or_synthesize(self.spoken[index])
+            self.deferred.discard(index)
+        paths = [segment.result() for segment in self.segments]
+        if len(paths) == 1:
+            return paths[0]
+        out_path = self.cache.path_for(full_text)
+        tmp = self.cache.temp_path(out_path)
+        concat_wavs(paths, tmp)
+        os.replace(tmp, out_path)
+        self.cache.maybe_evict()
+        return out_path